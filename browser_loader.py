@@ -9,10 +9,42 @@ Provides:
 """
 
 import asyncio
+import json
 import os
 from typing import Optional
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright
 
+# Default timeouts (ms) for actions without an explicit one; navigations keep Playwright's 30s
+DEFAULT_ACTION_TIMEOUT_MS = 8000
+DEFAULT_NAVIGATION_TIMEOUT_MS = 30000
+
+# JPEG quality for failure/diagnostic screenshots (a fraction of the PNG size and encode time)
+DIAGNOSTIC_JPEG_QUALITY = 60
+
+
+# Init script masking automation fingerprints (applied to every tab)
+_STEALTH_JS = """
+// Mask webdriver
+Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+
+// Mask plugins
+Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
+
+// Mask languages
+Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
+
+// Mask chrome property
+window.chrome = { runtime: {} };
+
+// Mask permissions
+const originalQuery = window.navigator.permissions.query;
+window.navigator.permissions.query = (parameters) => (
+    parameters.name === 'notifications' ?
+    Promise.resolve({ state: Notification.permission }) :
+    originalQuery(parameters)
+);
+"""
+
 
 class BrowserLoader:
     """
@@ -36,6 +68,7 @@ class BrowserLoader:
         self._stream_task: Optional[asyncio.Task] = None
         self._streaming = False
         self.pending_chat_action = False  # Flag for main loop to process
+        self._background_tasks: set[asyncio.Task] = set()  # Fire-and-forget work (e.g. error screenshots)
         
     async def launch(self) -> tuple[Browser, BrowserContext, Page]:
         """
@@ -86,6 +119,9 @@ class BrowserLoader:
             context_kwargs["viewport"] = {'width': 1920, 'height': 1080}
             
         self._context = await self._browser.new_context(**context_kwargs)
+        # Clicks/fills/waits without an explicit timeout fail fast instead of hanging 30s
+        self._context.set_default_timeout(DEFAULT_ACTION_TIMEOUT_MS)
+        self._context.set_default_navigation_timeout(DEFAULT_NAVIGATION_TIMEOUT_MS)
         
         self._page = await self._context.new_page()
         
@@ -94,30 +130,25 @@ class BrowserLoader:
         
         self._launched = True
     
+    async def new_context_page(self) -> Page:
+        """
+        Open an extra tab in the shared context (same session, stealth applied).
+        
+        Callers own the page and must close it when done.
+        
+        Returns:
+            The new Page
+        """
+        if not self._context:
+            raise RuntimeError("Browser not launched. Call launch() first.")
+        
+        page = await self._context.new_page()
+        await page.add_init_script(_STEALTH_JS)
+        return page
+    
     async def _apply_stealth(self, page: Page):
         """Apply stealth scripts to mask automation fingerprints."""
-        stealth_js = """
-        // Mask webdriver
-        Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-        
-        // Mask plugins
-        Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
-        
-        // Mask languages
-        Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
-        
-        // Mask chrome property
-        window.chrome = { runtime: {} };
-        
-        // Mask permissions
-        const originalQuery = window.navigator.permissions.query;
-        window.navigator.permissions.query = (parameters) => (
-            parameters.name === 'notifications' ?
-            Promise.resolve({ state: Notification.permission }) :
-            originalQuery(parameters)
-        );
-        """
-        await page.add_init_script(stealth_js)
+        await page.add_init_script(_STEALTH_JS)
         print("BROWSER: 🛡️ Stealth mode applied")
         
         # Start streaming automatically if requested or as a standard feature
@@ -549,7 +580,32 @@ class BrowserLoader:
         
         print("BROWSER: 🏁 Message check loop complete. No new messages found.")
         return False
-    
+
+    async def get_unread_count(self) -> Optional[int]:
+        """
+        Read the unread badge on the header's Inbox link of the current page (no navigation).
+
+        Returns:
+            Unread chat count (0 if no badge is shown), or None if the header
+            isn't on this page and the count is unknown
+        """
+        if not self._page or self._page.is_closed():
+            return None
+
+        try:
+            return await self._page.evaluate("""
+                () => {
+                    const link = document.querySelector('a[aria-label="Inbox"]');
+                    if (!link) return null;
+                    const badge = link.querySelector('div.D_azt');
+                    if (!badge || !badge.getClientRects().length) return 0;
+                    const n = parseInt(badge.textContent.trim(), 10);
+                    return isNaN(n) ? 1 : n;  // A dot without a number still means unread
+                }
+            """)
+        except Exception:
+            return None
+
     async def click_inbox_chat(self, index: int) -> bool:
         """
         Clicks on a chat in the inbox list by its index (0 is topmost).
@@ -584,12 +640,47 @@ class BrowserLoader:
                     return false;
                 }}
             """, index)
-            await asyncio.sleep(2)
+            # The chat opens client-side; callers wait for the chat input itself
+            await self._page.wait_for_load_state("domcontentloaded")
             return True
         except Exception as e:
             print(f"BROWSER: Failed to click chat: {e}")
             return False
 
+    def _spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _save_session(self, path: str = "auth/state.json"):
+        """Save storage state, overlapping the auth/ mkdir with the state RPC."""
+        _, state = await asyncio.gather(
+            asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True),
+            self._context.storage_state(),
+        )
+        await asyncio.to_thread(self._write_json, path, state)
+
+    @staticmethod
+    def _write_json(path: str, data):
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    @staticmethod
+    def _write_bytes(path: str, data: bytes):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    @staticmethod
+    def _log_write_error(task: asyncio.Task, path: str):
+        """Done-callback for a background file write: report failures (nothing awaits it)."""
+        if not task.cancelled() and task.exception():
+            print(f"BROWSER: ✗ Failed to write {path}: {task.exception()}")
+
     async def wait_for_selector(self, selector: str, timeout: int = 10000) -> bool:
         """
         Wait for a selector to appear on the page.
@@ -610,28 +701,42 @@ class BrowserLoader:
         except Exception:
             return False
     
-    async def screenshot(self, path: str = "screenshot.png") -> str:
+    async def screenshot(self, path: str = "screenshot.png", fmt: str = "png", page: Optional[Page] = None) -> str:
         """
         Take a screenshot of the current page.
         
+        The image is captured in memory and written to disk in the background
+        (off the event loop); close() waits for pending writes.
+        
         Args:
             path: Path to save the screenshot
+            fmt: "png", or "jpeg" for cheaper diagnostic captures
+            page: Tab to capture instead of the main page (e.g. a worker tab)
             
         Returns:
-            Path to the saved screenshot
+            Path the screenshot is being saved to (write errors are logged, not raised)
         """
-        if not self._page:
+        page = page or self._page
+        if not page:
             print("BROWSER: Error - No page available for screenshot")
             return ""
             
-        await self._page.screenshot(path=path, full_page=False)
-        print(f"BROWSER: ✓ Screenshot saved → {path}")
+        options = {"type": "jpeg", "quality": DIAGNOSTIC_JPEG_QUALITY} if fmt == "jpeg" else {}
+        data = await page.screenshot(full_page=False, **options)
+        write = self._spawn(asyncio.to_thread(self._write_bytes, path, data))
+        write.add_done_callback(lambda task: self._log_write_error(task, path))
+        print(f"BROWSER: ✓ Screenshot captured, writing → {path}")
         return path
     
     async def close(self):
         """Close the browser and clean up resources."""
         print("BROWSER: Closing browser...")
         
+        # Let in-flight background work (e.g. error screenshots, screenshot writes) finish
+        # first; loop because a finishing task may spawn another (capture → write)
+        while self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        
         if self._page:
             await self._page.close()
         if self._context:
@@ -826,7 +931,7 @@ class BrowserLoader:
             
             if not username_filled:
                 print("BROWSER: ✗ Could not find username field")
-                await self.screenshot("screenshots/login_error_username.png")
+                self._spawn(self.screenshot("screenshots/login_error_username.jpg", fmt="jpeg"))
                 return False
             
             # Step 3: Fill password field
@@ -850,7 +955,7 @@ class BrowserLoader:
             
             if not password_filled:
                 print("BROWSER: ✗ Could not find password field")
-                await self.screenshot("screenshots/login_error_password.png")
+                self._spawn(self.screenshot("screenshots/login_error_password.jpg", fmt="jpeg"))
                 return False
             
             # Step 4: Click login button
@@ -875,39 +980,54 @@ class BrowserLoader:
             
             if not clicked:
                 print("BROWSER: ✗ Could not find submit button")
-                await self.screenshot("screenshots/login_error_submit.png")
+                self._spawn(self.screenshot("screenshots/login_error_submit.jpg", fmt="jpeg"))
                 return False
             
             # Step 5: Wait for login to complete
             print("BROWSER: Login submitted, waiting for verification...")
             print("BROWSER: ⚠️  If you see a CAPTCHA, please solve it manually in the browser window.")
             
-            # Wait up to 60 seconds for login to complete
-            for i in range(60):
-                await asyncio.sleep(1)
-                current_url = self._page.url
+            # Wait up to 60 seconds for login to complete. Navigation away from the
+            # login page is signalled by a framenavigated event instead of polling page.url
+            left_login = asyncio.Event()
+            
+            def on_nav(frame):
+                if frame is self._page.main_frame and "/login" not in frame.url:
+                    left_login.set()
+            
+            self._page.on("framenavigated", on_nav)
+            try:
+                # Submitting may have navigated before the listener was attached
+                if "/login" not in self._page.url:
+                    left_login.set()
                 
-                # If we navigated away from login page, success!
-                if "/login" not in current_url:
-                    print("BROWSER: ✓ Login successful!")
-                    
-                    # Save storage state for future sessions
-                    os.makedirs("auth", exist_ok=True)
-                    await self._context.storage_state(path="auth/state.json")
-                    print("BROWSER: ✓ Session saved to auth/state.json")
-                    return True
+                for waited in range(10, 70, 10):
+                    try:
+                        await asyncio.wait_for(left_login.wait(), timeout=10)
+                        break
+                    except asyncio.TimeoutError:
+                        # Show progress every 10 seconds
+                        if waited < 60:
+                            print(f"BROWSER: Still waiting... ({waited}s) - solve CAPTCHA if present")
+            finally:
+                self._page.remove_listener("framenavigated", on_nav)
+            
+            # If we navigated away from login page, success!
+            if left_login.is_set():
+                print("BROWSER: ✓ Login successful!")
                 
-                # Show progress every 10 seconds
-                if (i + 1) % 10 == 0:
-                    print(f"BROWSER: Still waiting... ({i + 1}s) - solve CAPTCHA if present")
+                # Save storage state for future sessions
+                await self._save_session("auth/state.json")
+                print("BROWSER: ✓ Session saved to auth/state.json")
+                return True
             
             print("BROWSER: ⚠️ Login verification timed out after 60s.")
-            await self.screenshot("screenshots/login_timeout.png")
+            self._spawn(self.screenshot("screenshots/login_timeout.jpg", fmt="jpeg"))
             return False
                 
         except Exception as e:
             print(f"BROWSER: ✗ Login failed: {e}")
-            await self.screenshot("screenshots/login_error.png")
+            self._spawn(self.screenshot("screenshots/login_error.jpg", fmt="jpeg"))
             return False
 
     
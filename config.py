@@ -26,6 +26,7 @@ class AgentConfig(BaseModel):
     initial_lowball_percent: int = 50
     max_offer_percent: int = 70
     headless_browser: bool = False
+    parallel_tool_calls: bool = True  # Overlap independent tool calls from one LLM turn
     username: str = ""
     password: str = ""
 
@@ -46,6 +47,7 @@ class Config:
             initial_lowball_percent=int(os.getenv("INITIAL_LOWBALL_PERCENT", "50")),
             max_offer_percent=int(os.getenv("MAX_OFFER_PERCENT", "70")),
             headless_browser=os.getenv("HEADLESS_BROWSER", "false").lower() == "true",
+            parallel_tool_calls=os.getenv("PARALLEL_TOOL_CALLS", "true").lower() == "true",
             username=os.getenv("CAROUSELL_USERNAME", ""),
             password=os.getenv("CAROUSELL_PASSWORD", ""),
         )
@@ -9,17 +9,1128 @@ Provides:
 """
 
 import asyncio
+import contextvars
+import inspect
 import json
 import re
-from typing import Optional, Callable, Any
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Optional, Callable, Any, AsyncIterator, TYPE_CHECKING
 from datetime import datetime
+from types import MappingProxyType
+from urllib.parse import quote
 
-from browser_loader import BrowserLoader
-from dom_extractor import extract_dom
-from dom_parser import parse_listings, filter_listings_by_price, format_listings_for_display, extract_listing_details
-from llm_factory import LLMClient, LLMFactory
 from config import config
 
+try:
+    import orjson  # Faster JSON for tool-call arguments and results
+    from orjson import loads as _json_loads
+    ORJSON_AVAILABLE = True
+except ImportError:
+    from json import loads as _json_loads
+    ORJSON_AVAILABLE = False
+
+if TYPE_CHECKING:
+    # Type-only: browser_loader pulls in Playwright, llm_factory pulls in LiteLLM
+    from browser_loader import BrowserLoader
+    from llm_factory import LLMClient
+    from playwright.async_api import Page
+
+
+# Chat button selectors shared by open_chat and delegate_lowball, most specific first
+_CHAT_BUTTON_SELECTORS = (
+    '[data-testid="chat-button"]',
+    ':text-is("View Chat")',
+    ':text-is("Chat")',
+    'button:has-text("Chat")',
+    'a:has-text("Chat")',
+)
+
+# open_chat also accepts the offer / direct-message entry points, after the chat buttons
+_OPEN_CHAT_SELECTORS = (
+    *_CHAT_BUTTON_SELECTORS,
+    'button:has-text("Make Offer")',
+    'button:has-text("Direct Message")',
+)
+
+# Any listing-page chat button as one compound selector. Only used to wait for the
+# button to render: a compound selector matches in DOM order, not priority order.
+_VIEW_CHAT_SELECTOR = ", ".join(_CHAT_BUTTON_SELECTORS)
+
+# Listing-page chat buttons for the in-page click, most specific first: a CSS selector or
+# an exact (whitespace-normalized) button text
+_CHAT_CLICK_PRIORITY = (
+    {"selector": '[data-testid="chat-button"]'},
+    {"text": "View Chat"},
+    {"text": "Chat"},
+)
+
+# Find-and-click the listing-page chat button in one evaluate (one CDP round trip).
+# Walks _CHAT_CLICK_PRIORITY inside the listing container; returns null when there is
+# no container, no match, or more than one visible match for the first matching entry,
+# so the caller falls back to the Playwright locator.
+_CLICK_CHAT_JS = """
+([scope, candidates]) => {
+    const root = document.querySelector(scope);
+    if (!root) return null;
+    const visible = el => el.offsetParent !== null || el.getClientRects().length > 0;
+    const label = el => (el.innerText || '').replace(/\\s+/g, ' ').trim();
+    const clickables = Array.from(root.querySelectorAll('button, a, [role="button"]')).filter(visible);
+    for (const c of candidates) {
+        let matches = c.selector
+            ? Array.from(root.querySelectorAll(c.selector)).filter(visible)
+            : clickables.filter(el => label(el) === c.text);
+        // A link wrapping a button (or vice versa) is one control: keep the outermost
+        matches = matches.filter(el => !matches.some(o => o !== el && o.contains(el)));
+        if (matches.length > 1) return null;
+        if (matches.length === 1) { matches[0].click(); return c.selector || c.text; }
+    }
+    return null;
+}
+"""
+
+# In-page port of dom_parser.extract_listing_details: returns the same small dict
+# (description, structured_details, condition) instead of shipping the whole DOM.
+# null when neither section is on the page, so the caller falls back to the HTML parse.
+_LISTING_DETAILS_JS = """
+() => {
+    // BeautifulSoup get_text(strip=True): stripped text nodes, concatenated
+    const text = el => {
+        const walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT);
+        let out = '';
+        for (let n = walker.nextNode(); n; n = walker.nextNode()) out += n.nodeValue.trim();
+        return out;
+    };
+    // soup.find(['h2', 'h3', 'p'], string=re): a leaf heading whose text matches
+    const headings = document.querySelectorAll('h2, h3, p');
+    const heading = re => {
+        for (const el of headings) {
+            if (el.childElementCount === 0 && re.test(el.textContent)) return el;
+        }
+        return null;
+    };
+    
+    const details = {};
+    let desc = document.querySelector('[data-testid*="description"], [class*="description"]');
+    const descHeader = desc ? null : heading(/Description/i);
+    if (descHeader) {
+        // find_next(['div', 'p', 'span']): next such element in document order
+        const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT);
+        walker.currentNode = descHeader;
+        for (let n = walker.nextNode(); n; n = walker.nextNode()) {
+            if (n.tagName === 'DIV' || n.tagName === 'P' || n.tagName === 'SPAN') { desc = n; break; }
+        }
+    }
+    const detailsHeader = heading(/Details/i);
+    if (!desc && !detailsHeader) return null;
+    details.description = desc ? desc.innerText.trim() : 'No description found.';
+    
+    if (detailsHeader) {
+        const container = (detailsHeader.parentElement && detailsHeader.parentElement.parentElement)
+            || detailsHeader.parentElement;
+        const elements = Array.from(container.querySelectorAll('p, span, div'));
+        const labels = ['Condition', 'Battery Health', 'Screen', 'Body', 'Warranty', 'Model', 'Storage', 'Color', 'Set'];
+        const pairs = {};
+        let found = false;
+        for (let i = 0; i + 1 < elements.length; i++) {
+            const label = text(elements[i]);
+            if (label.length >= 30 || !labels.some(l => label.includes(l))) continue;
+            const value = text(elements[i + 1]);
+            if (value && value !== label) { pairs[label] = value; found = true; }
+        }
+        if (found) {
+            details.structured_details = pairs;
+            details.condition = pairs['Condition'] || '';
+        }
+    }
+    return details;
+}
+"""
+
+# Text of the page's Schema.org JSON-LD blocks (usually in <head>), for dom_parser.parse_json_ld_product
+_JSON_LD_JS = """
+() => Array.from(document.querySelectorAll('script[type="application/ld+json"]'), s => s.textContent)
+"""
+
+# Listing details and JSON-LD blocks in a single evaluate
+_LISTING_PAGE_JS = (
+    f"() => ({{ details: ({_LISTING_DETAILS_JS.strip()})(), jsonLd: ({_JSON_LD_JS.strip()})() }})"
+)
+
+# Blocking-popup detection: large visible dialogs, then large high z-index overlays.
+# Overlays are only looked for in a shortlist (inline z-index, modal/overlay/popup
+# classes, top-level portal divs) instead of getComputedStyle on every element.
+_DETECT_POPUP_JS = """
+() => {
+    const viewportArea = window.innerWidth * window.innerHeight;
+    const shown = (style) => style.display !== 'none' && style.visibility !== 'hidden';
+    
+    // Dialogs - must be visible and cover at least 30% of the viewport
+    for (const d of document.querySelectorAll('[role="dialog"], [aria-modal="true"], dialog[open]')) {
+        const style = window.getComputedStyle(d);
+        if (!shown(style) || style.opacity === '0') continue;
+        const rect = d.getBoundingClientRect();
+        if (rect.width * rect.height > viewportArea * 0.3 && rect.width > 200 && rect.height > 200) {
+            return { found: true, type: 'dialog' };
+        }
+    }
+    
+    // High z-index overlays - must cover at least 40% of the viewport
+    const candidates = document.querySelectorAll(
+        'div[style*="z-index"], [class*="modal"], [class*="Modal"], [class*="overlay"], ' +
+        '[class*="Overlay"], [class*="popup"], dialog, body > div, body > div > div'
+    );
+    for (const el of candidates) {
+        const rect = el.getBoundingClientRect();
+        if (rect.width <= 300 || rect.height <= 300 || rect.width * rect.height <= viewportArea * 0.4) continue;
+        const style = window.getComputedStyle(el);
+        const zIndex = parseInt(style.zIndex) || 0;
+        if (zIndex >= 1000 && shown(style)) {
+            return { found: true, type: 'overlay', zIndex: zIndex };
+        }
+    }
+    
+    return { found: false };
+}
+"""
+
+# Returns true if the DOM changed since the last call (or the document is new), using
+# a MutationObserver installed on first call, so idle pages skip popup detection.
+_POPUP_DIRTY_JS = """
+() => {
+    if (!window.__popupObserver) {
+        if (!document.body) return true;
+        window.__popupObserver = new MutationObserver(() => { window.__popup_dirty = true; });
+        window.__popupObserver.observe(document.body, {
+            childList: true, subtree: true, attributes: true,
+            attributeFilter: ['class', 'style', 'open', 'aria-hidden'],
+        });
+        return true;
+    }
+    const dirty = !!window.__popup_dirty;
+    window.__popup_dirty = false;
+    return dirty;
+}
+"""
+
+# Click a visible close/X button (or close-labelled SVG) if there is one
+_DISMISS_POPUP_JS = """
+() => {
+    // Helper to safely get className (handles SVGAnimatedString)
+    const getClassName = (el) => {
+        if (!el || !el.className) return '';
+        if (typeof el.className === 'string') return el.className;
+        if (el.className.baseVal !== undefined) {
+            const baseVal = el.className.baseVal;
+            return typeof baseVal === 'string' ? baseVal : String(baseVal);
+        }
+        return String(el.className);
+    };
+    const visible = (el) => el.offsetParent !== null || el.getClientRects().length > 0;
+    
+    // Explicit close controls first
+    for (const el of document.querySelectorAll(
+        'button[aria-label="Close" i], button[aria-label*="close" i], svg[aria-label="Close" i]'
+    )) {
+        const target = el.closest('button, [role="button"]') || el;
+        if (visible(target)) {
+            target.click();
+            return true;
+        }
+    }
+    
+    // Find all buttons and check for X/close
+    const buttons = document.querySelectorAll('button, [role="button"]');
+    for (let btn of buttons) {
+        // textContent (not innerText) so non-candidates never force a layout
+        const text = (btn.textContent || '').trim();
+        const hay = (text + '|' + (btn.getAttribute('aria-label') || '') + '|' + getClassName(btn)).toLowerCase();
+        const isClose = text === '×' || text === '✕' || text === '✖' || hay.includes('close');
+        if (!isClose || hay.includes('continue') || hay.includes('next')) continue;
+        
+        // Style/layout reads only for actual candidates
+        const style = window.getComputedStyle(btn);
+        if (style.display === 'none' || style.visibility === 'hidden') continue;
+        const rect = btn.getBoundingClientRect();
+        if (rect.width > 0 && rect.height > 0) {
+            btn.click();
+            return true;
+        }
+    }
+    
+    // Check SVG icons (with proper className handling)
+    const svgs = document.querySelectorAll('svg');
+    for (let svg of svgs) {
+        const style = window.getComputedStyle(svg);
+        if (style.display === 'none') continue;
+        
+        const ariaLabel = (svg.getAttribute('aria-label') || '').toLowerCase();
+        const className = getClassName(svg).toLowerCase();
+        
+        if (ariaLabel.includes('close') || className.includes('close')) {
+            const parent = svg.closest('button, [role="button"], a, div, span');
+            if (parent) {
+                parent.click();
+                return true;
+            }
+        }
+    }
+    
+    return false;
+}
+"""
+
+# Detect → click → re-detect loop for up to n attempts, in one call. "stuck" means a
+# popup is showing but no close control was found twice (caller falls back to ESC).
+_DISMISS_POPUP_RETRY_JS = """
+async (n) => {
+    const pause = (ms) => new Promise(r => setTimeout(r, ms));
+    // Resolves as soon as the popup is gone (closing animations vary), or after ms
+    const closed = async (ms) => {
+        for (let t = 0; t < ms && window.__detectPopup().found; t += 30) await pause(30);
+    };
+    let dismissed = false;
+    let misses = 0;
+    for (let i = 0; i < n; i++) {
+        if (!window.__detectPopup().found) return { dismissed, stuck: false };
+        if (window.__dismissPopup()) {
+            dismissed = true;
+            await closed(300);
+            continue;
+        }
+        if (++misses >= 2) return { dismissed, stuck: true };
+        await pause(Math.min(50 * 2 ** misses, 400));  // Backoff before retrying the click
+    }
+    return { dismissed, stuck: false };
+}
+"""
+
+# In-page auto-dismiss: a MutationObserver that closes popups as they appear, with no
+# round-trip to Python. Debounced per burst of mutations; gives up on a document after
+# a few failed clicks (a popup it cannot close is left to dismiss_popups' Escape fallback).
+_POPUP_AUTO_DISMISS_JS = """
+() => {
+    if (window.__popupAutoObserver) return;
+    let scheduled = false;
+    let failures = 0;
+    window.__popupAutoObserver = new MutationObserver(() => {
+        if (scheduled || failures >= 3) return;
+        scheduled = true;
+        setTimeout(() => {
+            scheduled = false;
+            if (!window.__detectPopup().found) return;
+            if (window.__dismissPopup()) failures = 0;
+            else failures++;
+        }, 150);
+    });
+    window.__popupAutoObserver.observe(document.body, {
+        childList: true, subtree: true, attributes: true,
+        attributeFilter: ['class', 'style', 'open', 'aria-hidden'],
+    });
+}
+"""
+
+# Installs the popup scripts above as window.__detectPopup / __dismissPopup /
+# __dismissPopupRetry / __popupDirty, and starts the auto-dismiss observer.
+# Registered once per browser context as an init script (re-runs on every navigation), so each
+# check afterwards sends only the short _CALL_POPUP_HELPER_JS instead of the full source.
+_POPUP_HELPERS_JS = (
+    "(() => {\n"
+    "if (window.__detectPopup) return;\n"
+    f"window.__detectPopup = {_DETECT_POPUP_JS.strip()};\n"
+    f"window.__dismissPopup = {_DISMISS_POPUP_JS.strip()};\n"
+    f"window.__dismissPopupRetry = {_DISMISS_POPUP_RETRY_JS.strip()};\n"
+    f"window.__popupDirty = {_POPUP_DIRTY_JS.strip()};\n"
+    f"const autoDismiss = {_POPUP_AUTO_DISMISS_JS.strip()};\n"
+    # Init scripts run before <body> exists
+    "if (document.body) autoDismiss();\n"
+    "else document.addEventListener('DOMContentLoaded', autoDismiss, { once: true });\n"
+    "})()"
+)
+_CALL_POPUP_HELPER_JS = "([name, arg]) => typeof window[name] === 'function' ? window[name](arg) : '__missing__'"
+# True once no blocking popup is detected (helpers missing counts as closed)
+_POPUP_CLOSED_JS = "() => !(window.__detectPopup && window.__detectPopup().found)"
+
+# Popup monitor wake condition: DOM changed since the last check and a popup is showing
+_POPUP_PENDING_JS = (
+    "() => typeof window.__popupDirty === 'function' && window.__popupDirty() && window.__detectPopup().found"
+)
+
+# Report of dialogs, high z-index elements, close buttons and overlays (debug_popups)
+_DEBUG_POPUPS_JS = """
+(fullScan) => {
+    // Only the entries the report prints are sent back (bounded payload); counts cover all
+    const LIMITS = { dialogs: 20, highZIndex: 5, closeButtons: 10, overlays: 5 };
+    const report = { dialogs: [], highZIndex: [], closeButtons: [], overlays: [] };
+    const counts = { dialogs: 0, highZIndex: 0, closeButtons: 0, overlays: 0 };
+    const add = (kind, make) => {
+        if (counts[kind]++ < LIMITS[kind]) report[kind].push(make());
+    };
+    // getAttribute works for SVG elements too (their className is not a string)
+    const cls = (el) => el.getAttribute('class') || '';
+    const POPUP_CLASS = /modal|overlay|popup/i;
+    
+    // Find dialogs
+    const dialogs = document.querySelectorAll('[role="dialog"]');
+    dialogs.forEach((d, i) => {
+        const style = window.getComputedStyle(d);
+        add('dialogs', () => ({
+            index: i,
+            visible: style.display !== 'none',
+            zIndex: style.zIndex,
+            className: cls(d).substring(0, 30)
+        }));
+    });
+    
+    // Find high z-index elements. Unless fullScan, only computed styles of likely
+    // stacking candidates (inline z-index, a role, modal-ish class) are read
+    const walker = document.body && document.createTreeWalker(
+        document.body,
+        NodeFilter.SHOW_ELEMENT,
+        fullScan ? null : {
+            acceptNode: (n) => (n.style && n.style.zIndex) || n.hasAttribute('role') || POPUP_CLASS.test(cls(n))
+                ? NodeFilter.FILTER_ACCEPT
+                : NodeFilter.FILTER_SKIP
+        }
+    );
+    for (let el = walker && walker.nextNode(); el; el = walker.nextNode()) {
+        const style = window.getComputedStyle(el);
+        const zIndex = parseInt(style.zIndex) || 0;
+        if (zIndex >= 1000 && style.display !== 'none') {
+            const rect = el.getBoundingClientRect();
+            if (rect.width > 100 && rect.height > 100) {
+                add('highZIndex', () => ({
+                    tag: el.tagName,
+                    zIndex: zIndex,
+                    className: cls(el).substring(0, 50),
+                    size: `${Math.round(rect.width)}x${Math.round(rect.height)}`
+                }));
+            }
+        }
+    }
+    
+    // Find potential close buttons
+    const buttons = document.querySelectorAll('button, [role="button"]');
+    buttons.forEach((btn) => {
+        const text = (btn.textContent || '').trim();
+        const ariaLabel = btn.getAttribute('aria-label') || '';
+        const hay = (text + '|' + ariaLabel + '|' + cls(btn)).toLowerCase();
+        if (hay.includes('close') || text === '×' || text === '✕' || text === '✖') {
+            const style = window.getComputedStyle(btn);
+            if (style.display !== 'none') {
+                add('closeButtons', () => ({
+                    text: text.substring(0, 50),
+                    ariaLabel: ariaLabel,
+                    visible: style.display !== 'none'
+                }));
+            }
+        }
+    });
+    
+    // Find overlays/modals by class (one case-insensitive query)
+    document.querySelectorAll('[class*="modal" i], [class*="overlay" i], [class*="popup" i]').forEach(el => {
+        const style = window.getComputedStyle(el);
+        if (style.display !== 'none') {
+            add('overlays', () => ({
+                match: cls(el).match(POPUP_CLASS)[0].toLowerCase(),
+                className: cls(el).substring(0, 50),
+                zIndex: style.zIndex
+            }));
+        }
+    });
+    
+    report.counts = counts;
+    return report;
+}
+"""
+
+# DOM states the handlers actually need (waited on instead of fixed sleeps)
+_LISTING_CARD_SELECTOR = '[data-testid^="listing-card-"], article'
+_CHAT_INPUT_SELECTOR = 'textarea, [contenteditable="true"]'
+
+# Chat message textarea, plus alternatives accepted when it is not found (voice messages)
+_CHAT_TEXTBOX_SELECTOR = 'textarea[placeholder="Type here..."]'
+_CHAT_INPUT_FALLBACK_SELECTORS = (
+    'textarea[placeholder*="Type"]',
+    'textarea[placeholder*="message"]',
+    '[contenteditable="true"]',
+    'textarea',
+)
+
+
+@lru_cache(maxsize=64)
+def _search_url(query: str, price_end: Optional[int] = None) -> str:
+    """
+    Carousell search URL for a query.
+    
+    The query is fully percent-encoded as one path segment (spaces, &, #, ?,
+    non-ASCII); the price cap is applied server-side via price_end.
+    """
+    url = config.search_url_template.format(query=quote(query.strip(), safe=""))
+    if price_end:
+        url += f"?price_end={price_end}"
+    return url
+
+
+async def _wait_for_selector(page, selector: str, timeout: int = 5000) -> bool:
+    """
+    Wait until selector is attached, without raising on timeout.
+
+    Args:
+        page: Playwright page
+        selector: CSS selector to wait for
+        timeout: Max wait in milliseconds
+
+    Returns:
+        True if the element appeared, False on timeout/error
+    """
+    try:
+        await page.wait_for_selector(selector, timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+
+async def _wait_for_dom(page, timeout: int = 5000) -> None:
+    """Wait for DOMContentLoaded, ignoring timeouts (slow pages still proceed)."""
+    try:
+        await page.wait_for_load_state("domcontentloaded", timeout=timeout)
+    except Exception:
+        pass
+
+
+# Listing content container, serialized instead of the whole page when parsing details
+_LISTING_MAIN_SELECTOR = '[data-testid="listing-detail"], main'
+
+
+async def _read_listing_details(page) -> dict:
+    """
+    Description and structured details of the open listing page.
+    
+    Extracted in-page (a few KB over CDP); falls back to serializing the listing's
+    main content and parsing it with dom_parser when the page doesn't have the
+    expected sections. The page's Product JSON-LD, read in the same evaluate,
+    is merged into either result.
+    """
+    page_data = await page.evaluate(_LISTING_PAGE_JS)
+    dom_parser = await asyncio.to_thread(_load_dom_parser)
+    details = page_data["details"]
+    if not details:
+        main = page.locator(_LISTING_MAIN_SELECTOR).first
+        html = await main.inner_html() if await main.count() else await page.content()
+        details = await asyncio.to_thread(dom_parser.extract_listing_details, html)
+    product = dom_parser.parse_json_ld_product(page_data["jsonLd"])
+    return dom_parser.merge_json_ld_product(details, product)
+
+
+# Accessible-name pattern for the role-based chat button fallback
+_CHAT_BTN_RE = re.compile(r"Chat", re.I)
+
+
+async def _click_chat_fallback(page, selectors: tuple, timeout: int = 5000) -> Optional[str]:
+    """
+    Click the first visible chat control inside the listing container, in priority order.
+    
+    A compound selector (or Locator.or_) resolves in DOM order, where a header
+    "Chats" link or a hidden duplicate could win, so once any alternative is
+    visible each one is checked in turn.
+    
+    Args:
+        page: Listing page
+        selectors: Playwright selectors, most specific first (the role query goes last)
+        timeout: How long to wait (ms) for any of them to become visible
+        
+    Returns:
+        The alternative that was clicked, or None if none became visible
+    """
+    root = page.locator(_LISTING_MAIN_SELECTOR).first
+    candidates = [(selector, root.locator(f"{selector} >> visible=true")) for selector in selectors]
+    candidates.append(("role=button", root.get_by_role("button", name=_CHAT_BTN_RE).locator("visible=true")))
+    
+    any_visible = candidates[0][1]
+    for _, locator in candidates[1:]:
+        any_visible = any_visible.or_(locator)
+    try:
+        await any_visible.first.wait_for(state="visible", timeout=timeout)
+    except Exception:
+        return None
+    
+    for name, locator in candidates:
+        if await locator.count():
+            await locator.first.click(timeout=1000)  # Already visible: only actionability checks remain
+            return name
+    return None
+
+
+# URL of a listing page (waited on after navigating to a listing)
+_LISTING_URL_RE = re.compile(r"/(p|listing)/")
+
+
+# Search result cache: max entries and freshness window (seconds)
+_SEARCH_CACHE_SIZE = 32
+_SEARCH_CACHE_TTL = 300
+
+# Max listing pages whose parsed details are kept (oldest dropped first)
+_DETAILS_CACHE_SIZE = 64
+
+
+# Tool result line templates (bound .format avoids rebuilding f-strings per call)
+_OK = "✓ {tool}: {message}".format
+_FAIL = "✗ {tool}: {message}".format
+
+
+# Structured tool result: {"ok": bool, "tool": str, "data": Any, "message": str}.
+# Handlers leave "tool" empty; _invoke fills it in.
+ToolResult = dict
+
+
+def _success(message: str, data: Any = None) -> ToolResult:
+    """Build a successful ToolResult."""
+    return {"ok": True, "tool": "", "data": data, "message": message}
+
+
+def _failure(message: str, data: Any = None) -> ToolResult:
+    """Build a failed ToolResult (the handler ran but could not do the job)."""
+    return {"ok": False, "tool": "", "data": data, "message": message}
+
+
+def _listing_summaries(listings: list[dict]) -> list[dict]:
+    """Compact, index-addressable view of listings for the LLM."""
+    return [
+        {"index": l.get("index", i), "id": l.get("listing_id"), "title": l.get("title"), "price": l.get("price")}
+        for i, l in enumerate(listings)
+    ]
+
+
+def _parse_arguments(raw: Any) -> dict:
+    """
+    Normalize tool-call arguments to a dict.
+    
+    OpenAI-style responses carry arguments as a JSON string; other paths pass dicts.
+    
+    Args:
+        raw: Arguments as a dict, JSON string, or None
+        
+    Returns:
+        Arguments dict ({} if missing or malformed)
+    """
+    if isinstance(raw, dict):
+        return raw
+    if not raw:
+        return {}
+    try:
+        parsed = _json_loads(raw)
+    except (TypeError, ValueError) as e:
+        print(f"CONTROLLER: Warning - Could not parse tool arguments {raw!r}: {e}")
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def _json_dumps(obj: Any, sort_keys: bool = False) -> str:
+    """Compact JSON text (non-ASCII kept as-is, unknown types via str), using orjson when installed."""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=str, option=option).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str, sort_keys=sort_keys)
+
+
+def _truncate(text: str, limit: Optional[int] = None) -> str:
+    """Cut text to limit characters (default _TOOL_CONTENT_MAX_CHARS), marking the cut."""
+    limit = limit or _TOOL_CONTENT_MAX_CHARS
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"…[truncated {len(text) - limit} chars]"
+
+
+def _format_result(result: ToolResult) -> str:
+    """One-line human summary of a ToolResult."""
+    return (_OK if result["ok"] else _FAIL)(**result)
+
+
+# Tools that may run in the worker tab when the main page is busy
+_WORKER_TAB_TOOLS = frozenset({"delegate_lowball"})
+
+# Tools that replace the listings (worker-tab calls must wait behind these)
+_LISTING_TOOLS = frozenset({"search_carousell", "extract_listings"})
+
+# Meta-tool whose invocations are expanded into separate calls of the same turn
+_BATCH_TOOL = "batch"
+
+# Tools that message sellers: never started speculatively mid-stream, only once the
+# response that requested them has streamed to the end without error
+_CONFIRMED_TOOLS = frozenset({"delegate_lowball", "send_voice_message"})
+
+
+# Tool schemas for LLM function calling. Module-level so every request sends the
+# same objects (stable identity and bytes for provider-side prompt caching).
+# Plain dicts rather than read-only proxies: LiteLLM serializes/copies them.
+_TOOLS: list[dict] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_carousell",
+            "description": "Search for items on Carousell Singapore. Use this when the user wants to find listings.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The search query (e.g., 'iPhone 14', 'MacBook Pro')"
+                    },
+                    "max_price": {
+                        "type": "number",
+                        "description": "Optional maximum price filter"
+                    }
+                },
+                "required": ["query"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "extract_listings",
+            "description": "Extract and display current listings from the search results page.",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "open_listing",
+            "description": "Open a specific listing by its index number from the extracted listings.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "listing_index": {
+                        "type": "integer",
+                        "description": "The index number of the listing to open (from extract_listings results)"
+                    },
+                    "listing_id": {
+                        "type": "string",
+                        "description": "Stable listing id (from search/extract results); preferred over listing_index"
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "compare_listings",
+            "description": "Read the description and condition of several listings at once (fetched in parallel, without leaving the current page).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "listing_indices": {
+                        "type": "array",
+                        "items": {"type": "integer"},
+                        "description": "Index numbers of the listings to compare (from extract_listings results)"
+                    },
+                    "listing_ids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Stable listing ids (from search/extract results); preferred over listing_indices"
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "open_chat",
+            "description": "Open the chat window for a specific seller/listing.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "listing_index": {
+                        "type": "integer",
+                        "description": "The index number of the listing to chat about"
+                    },
+                    "listing_id": {
+                        "type": "string",
+                        "description": "Stable listing id (from search/extract results); preferred over listing_index"
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "delegate_lowball",
+            "description": "Delegate negotiation to the Lowballer agent for a specific listing.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "listing_index": {
+                        "type": "integer",
+                        "description": "The index of the listing to negotiate"
+                    },
+                    "listing_id": {
+                        "type": "string",
+                        "description": "Stable listing id (from search/extract results); preferred over listing_index"
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_chat",
+            "description": "Go to the Carousell inbox and stay idle to check for new messages or replies from sellers.",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "take_screenshot",
+            "description": "Take a screenshot of the current browser page.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "filename": {
+                        "type": "string",
+                        "description": "Optional filename for the screenshot"
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "send_voice_message",
+            "description": "Record audio from microphone, transcribe using Gemini AI, and send the message to the current chat.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "duration": {
+                        "type": "integer",
+                        "description": "Recording duration in seconds (default: 10)"
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "batch",
+            "description": "Run several independent tool calls in one step (e.g. open listings 0, 1 and 2). Calls that change the page still run in the order given.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "invocations": {
+                        "type": "array",
+                        "description": "Tool calls to run",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "tool_name": {
+                                    "type": "string",
+                                    "description": "Name of the tool to call"
+                                },
+                                "arguments": {
+                                    "type": "object",
+                                    "description": "Arguments for that tool"
+                                }
+                            },
+                            "required": ["tool_name"]
+                        }
+                    }
+                },
+                "required": ["invocations"]
+            }
+        }
+    },
+]
+
+# Static system prompt - kept byte-identical across turns so provider prompt caches hit
+_SYSTEM_PROMPT = """You are Carousell Lowballer, an AI assistant that helps users find and negotiate deals on Carousell Singapore.
+
+You have access to these tools:
+- search_carousell(query, max_price): Search for items
+- extract_listings(): Get current listings from page
+- open_listing(listing_index or listing_id): View a specific listing
+- compare_listings(listing_indices or listing_ids): Read descriptions/condition of several listings
+- open_chat(listing_index or listing_id): Open chat with seller
+- delegate_lowball(listing_index or listing_id): Start negotiation
+- send_voice_message(duration): Record voice, transcribe, and send to chat
+- check_chat(): Go to inbox and stay updated
+- take_screenshot(): Capture current page
+- batch(invocations): Run several independent tool calls in one step
+
+When the user asks to find items, use search_carousell first, then extract_listings to show results.
+When they want to compare listings (condition, details), use compare_listings rather than opening each one.
+When they want to negotiate, use delegate_lowball to start the lowball negotiation.
+When they want to send a voice message, use send_voice_message to record and send.
+When they want to check messages or see what sellers said, use check_chat.
+When several independent actions are needed at once, request them together in one batch call.
+
+Be helpful, proactive, and explain what you're doing."""
+
+_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+_SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and a Carousell shopping assistant in a few "
+    "short bullet points. Keep searches made, listing indexes/titles/prices discussed, and "
+    "negotiation outcomes."
+)
+
+# History is compacted once the tail grows past _TAIL_MAX_MESSAGES or
+# _TAIL_MAX_CHARS (~4000 tokens at ~4 chars/token), keeping roughly the last
+# _TAIL_KEEP_MESSAGES verbatim
+_TAIL_MAX_MESSAGES = 10
+_TAIL_MAX_CHARS = 16000
+_TAIL_KEEP_MESSAGES = 4
+
+# Upper bound (seconds) for one in-page popup wait and for the monitor's backoff
+_POPUP_MONITOR_MAX_INTERVAL = 30.0
+
+# Seconds a clean popup check of the same page URL stays valid for dismiss_popups
+_POPUP_CHECK_COOLDOWN = 1.0
+
+# Max characters of a tool result kept in history (bounds per-turn prompt size)
+_TOOL_CONTENT_MAX_CHARS = 2000
+
+# Max LLM → tool → LLM rounds per user prompt
+_MAX_TOOL_ROUNDS = 5
+
+
+# Session state for the run() in progress. Each asyncio task has its own context,
+# so overlapping run() calls (e.g. from a web frontend) never see each other's state.
+_SESSION: contextvars.ContextVar[dict] = contextvars.ContextVar("controller_session")
+
+# Tab the current tool call runs in, when it isn't the shared main page (see _worker_tab)
+_TAB: contextvars.ContextVar[Optional["Page"]] = contextvars.ContextVar("controller_tab", default=None)
+
+
+def _new_session() -> dict:
+    """Fresh per-session state: listings (with lookup tables) and conversation history."""
+    return {
+        "listings": [],
+        "by_index": {},  # Displayed index → listing (indexes can have gaps after price filtering)
+        "by_id": {},  # Stable listing id → listing (survives re-search / re-ordering)
+        "display": None,  # (listings list, formatted display) for the current listings
+        "prefix": [],  # Committed history (summaries), only grows between folds
+        "tail": [],  # Recent turns, compacted into the prefix over time (only at user messages)
+    }
+
+# Once the prefix holds more summaries than this, they are folded into one
+_PREFIX_MAX_SUMMARIES = 8
+
+
+def _with_cache_control(message: dict) -> dict:
+    """Return a copy of a message with an ephemeral cache_control breakpoint."""
+    return {
+        **message,
+        "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}],
+    }
+
+
+# Lazy-loaded DOM helpers (cached in module globals after first use)
+extract_dom = None
+_dom_parser = None
+
+
+def _load_extract_dom():
+    """Import dom_extractor.extract_dom on first use."""
+    global extract_dom
+    if extract_dom is None:
+        from dom_extractor import extract_dom as _extract_dom
+        extract_dom = _extract_dom
+    return extract_dom
+
+
+def _load_dom_parser():
+    """Import the dom_parser module (BeautifulSoup + pydantic) on first use."""
+    global _dom_parser
+    if _dom_parser is None:
+        import dom_parser
+        _dom_parser = dom_parser
+    return _dom_parser
+
+
+_speech_transcriber = None
+
+
+def _load_speech_transcriber():
+    """Import the speech_transcriber module (sounddevice + Gemini) on first use."""
+    global _speech_transcriber
+    if _speech_transcriber is None:
+        import speech_transcriber
+        _speech_transcriber = speech_transcriber
+    return _speech_transcriber
+
+
+_lowballer = None
+
+
+def _load_lowballer():
+    """Import the lowballer module on first use."""
+    global _lowballer
+    if _lowballer is None:
+        import lowballer
+        _lowballer = lowballer
+    return _lowballer
+
+
+class _ToolBatch:
+    """
+    Tool calls from one LLM turn, each dispatched the moment it is known.
+    
+    Mutating calls share the page and the session's listings, so they are
+    serialized (in call order) by the agent's browser lock; read-only calls
+    overlap with them freely, and worker-tab tools run in a second tab when
+    the main page is busy.
+    """
+    
+    def __init__(self, agent: "ControllerAgent", names: tuple = (), confirmed: bool = True):
+        """
+        Args:
+            agent: Agent whose handlers run the calls
+            names: Tool names of the whole batch, when known up front
+            confirmed: Whether the response is already complete (False while it is
+                still streaming; _CONFIRMED_TOOLS then wait for confirm())
+        """
+        self.agent = agent
+        self.names = set(names)  # Calls seen so far (or the full batch)
+        self.calls: list[dict] = []
+        self.results: list[Optional[ToolResult]] = []
+        self.tasks: list[asyncio.Task] = []
+        self.finished: asyncio.Queue[int] = asyncio.Queue()  # Call indexes, as they complete
+        self.first_index: dict[str, int] = {}  # "name|args" → index of the first such call
+        self.received = 0  # Calls handed to start() (a batch meta-call counts once)
+        self.confirmed = asyncio.Event()
+        self.accepted = True  # False if the stream failed: held calls are reported as not run
+        if confirmed:
+            self.confirmed.set()
+    
+    def confirm(self, accepted: bool = True):
+        """Release calls held for the end of the stream (or drop them if it failed)."""
+        self.accepted = accepted
+        self.confirmed.set()
+    
+    async def abort(self):
+        """
+        Drop the batch: held calls are released as not run, the rest are cancelled.
+        
+        Waits for every task to finish, so none is left holding the browser lock.
+        """
+        self.confirm(accepted=False)
+        for task in self.tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+    
+    def start(self, tc: dict):
+        """Normalize a tool call and start running it (or reuse an identical earlier call)."""
+        self.received += 1
+        tc = {**tc, "arguments": _parse_arguments(tc.get("arguments"))}
+        
+        if tc.get("name") == _BATCH_TOOL:
+            # Meta-call: each invocation becomes a call of this batch (and is recorded as one)
+            invocations = [
+                inv for inv in tc["arguments"].get("invocations") or ()
+                if isinstance(inv, dict) and inv.get("tool_name") not in (None, _BATCH_TOOL)
+            ]
+            for j, inv in enumerate(invocations):
+                self._add({
+                    "id": f"{tc.get('id') or 'batch'}_{j}",
+                    "name": inv["tool_name"],
+                    "arguments": _parse_arguments(inv.get("arguments")),
+                })
+            if invocations:
+                return
+        self._add(tc)
+    
+    def _add(self, tc: dict):
+        i = len(self.calls)
+        self.calls.append(tc)
+        self.results.append(None)
+        
+        key = f"{tc.get('name')}|{_json_dumps(tc['arguments'], sort_keys=True)}"
+        first = self.first_index.setdefault(key, i)
+        if first != i:
+            # The model repeated a call in the same turn: share the first one's result
+            self.tasks.append(asyncio.ensure_future(self._share(i, first)))
+            return
+        
+        self.names.add(tc.get("name"))
+        read_only = self.agent._is_read_only(tc.get("name"), self.names)
+        # Tasks start in call order and the lock is FIFO, so mutating calls keep call order
+        self.tasks.append(asyncio.ensure_future(self._run(i, tc, read_only)))
+    
+    async def _run(self, i: int, tc: dict, read_only: bool):
+        try:
+            if read_only:
+                self.results[i] = await self._call(tc)
+            elif self.agent._use_worker_tab(tc.get("name"), self.names):
+                # Main page is busy: navigate a second tab instead of queueing behind it
+                async with self.agent._worker_tab():
+                    self.results[i] = await self._call(tc)
+            else:
+                async with self.agent._browser_lock:
+                    self.results[i] = await self._call(tc)
+        except Exception as e:
+            self.results[i] = {"ok": False, "tool": tc.get("name"), "data": None, "message": f"Error - {e}"}
+        finally:
+            self.finished.put_nowait(i)
+    
+    async def _call(self, tc: dict) -> ToolResult:
+        if tc.get("name") == _BATCH_TOOL:
+            return {"ok": False, "tool": _BATCH_TOOL, "data": None, "message": "Error - batch needs a non-empty invocations list"}
+        # Held calls wait in their place in line (lock held), so later calls keep call order
+        if tc.get("name") in _CONFIRMED_TOOLS:
+            await self.confirmed.wait()
+            if not self.accepted:
+                return {"ok": False, "tool": tc.get("name"), "data": None, "message": "Not run - the response requesting it was cut off"}
+        return await self.agent._invoke(tc)
+    
+    async def _share(self, i: int, first: int):
+        try:
+            await asyncio.shield(self.tasks[first])
+            self.results[i] = dict(self.results[first])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.results[i] = {"ok": False, "tool": self.calls[i].get("name"), "data": None, "message": f"Error - {e}"}
+        finally:
+            self.finished.put_nowait(i)
+    
+    async def as_completed(self) -> AsyncIterator[ToolResult]:
+        """Yield every started call's result in completion order."""
+        try:
+            for _ in self.calls:
+                yield self.results[await self.finished.get()]
+        finally:
+            # Consumer stopped early: nothing may stay parked on confirmed (lock held)
+            self.confirm(accepted=False)
+            for task in self.tasks:
+                if not task.done():
+                    task.cancel()
+
 
 class ControllerAgent:
     """
@@ -27,7 +1138,19 @@ class ControllerAgent:
     Uses LLM tool-calling to interpret user commands and execute appropriate actions.
     """
     
-    def __init__(self, llm: LLMClient, browser_loader: BrowserLoader):
+    _TOOL_NAMES = (
+        "search_carousell",
+        "extract_listings",
+        "open_listing",
+        "compare_listings",
+        "open_chat",
+        "delegate_lowball",
+        "check_chat",
+        "take_screenshot",
+        "send_voice_message",
+    )
+    
+    def __init__(self, llm: "LLMClient", browser_loader: "BrowserLoader"):
         """
         Initialize the controller agent.
         
@@ -37,151 +1160,111 @@ class ControllerAgent:
         """
         self.llm = llm
         self.browser = browser_loader
-        self.current_listings: list[dict] = []
-        self.conversation_history: list[dict] = []
+        # session_id → session state (listings, history); see _new_session()
+        self._sessions: dict[str, dict] = {"default": _new_session()}
         self.lowballer = None  # Lazy-loaded
+        self._voice = None  # (AudioRecorder, SpeechTranscriber), created on first voice message
+        self._chat_textbox_cache: Optional[tuple[str, Any]] = None  # (chat page URL, input locator)
         self._popup_check_task: Optional[asyncio.Task] = None  # Background popup checker
+        self._popup_helper_contexts: "weakref.WeakSet" = weakref.WeakSet()  # Contexts with the popup init script
+        # Serializes page-mutating tool calls, within a batch and across concurrent sessions
+        self._browser_lock = asyncio.Lock()
+        # Second tab for calls that would otherwise wait on the main page, created on first use
+        self._worker_page: Optional["Page"] = None
+        self._worker_lock = asyncio.Lock()
+        self._background_tasks: set[asyncio.Task] = set()  # Fire-and-forget work (e.g. popup checks)
+        # Held while the main page navigates (the popup monitor waits it out)
+        self._nav_lock = asyncio.Lock()
+        # One popup dismissal at a time (avoids duplicate evaluates and double clicks)
+        self._popup_lock = asyncio.Lock()
+        # (monotonic time, page URL) of the last popup check that found nothing
+        self._last_popup_clear: tuple[float, str] = (0.0, "")
+        # (search_url, max_price) -> (timestamp, listings), least recently used first
+        self._search_cache: OrderedDict[tuple, tuple[float, list[dict]]] = OrderedDict()
+        # listing_url -> details parsed from the listing page (description etc.)
+        self._listing_details_cache: dict[str, dict] = {}
+        # Static system message, built once (with its cache breakpoint when supported)
+        self._cache_control = self._supports_cache_control()
+        self._system_message = _with_cache_control(_SYSTEM_MESSAGE) if self._cache_control else _SYSTEM_MESSAGE
         
         # Define available tools
-        self.tools = self._define_tools()
-        self.tool_handlers = self._define_tool_handlers()
+        self.tools = _TOOLS
+        self.tool_handlers = MappingProxyType(self._define_tool_handlers())  # Read-only after init
+        self._dispatch = self.tool_handlers.get  # Bound once: name → handler (or None)
+        # name → parameter names the handler accepts (signatures inspected once)
+        self._handler_params = MappingProxyType({
+            name: frozenset(inspect.signature(handler).parameters)
+            for name, handler in self.tool_handlers.items()
+        })
+        assert tuple(self.tool_handlers) == self._TOOL_NAMES, "tool handlers out of sync with _TOOL_NAMES"
         
-        print("CONTROLLER: Agent initialized with tools:", list(self.tool_handlers.keys()))
+        print("CONTROLLER: Agent initialized with tools:", self._TOOL_NAMES)
     
-    def _define_tools(self) -> list[dict]:
-        """Define the tool schemas for LLM function calling."""
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_carousell",
-                    "description": "Search for items on Carousell Singapore. Use this when the user wants to find listings.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "The search query (e.g., 'iPhone 14', 'MacBook Pro')"
-                            },
-                            "max_price": {
-                                "type": "number",
-                                "description": "Optional maximum price filter"
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "extract_listings",
-                    "description": "Extract and display current listings from the search results page.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "open_listing",
-                    "description": "Open a specific listing by its index number from the extracted listings.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "listing_index": {
-                                "type": "integer",
-                                "description": "The index number of the listing to open (from extract_listings results)"
-                            }
-                        },
-                        "required": ["listing_index"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "open_chat",
-                    "description": "Open the chat window for a specific seller/listing.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "listing_index": {
-                                "type": "integer",
-                                "description": "The index number of the listing to chat about"
-                            }
-                        },
-                        "required": ["listing_index"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "delegate_lowball",
-                    "description": "Delegate negotiation to the Lowballer agent for a specific listing.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "listing_index": {
-                                "type": "integer",
-                                "description": "The index of the listing to negotiate"
-                            }
-                        },
-                        "required": ["listing_index"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "check_chat",
-                    "description": "Go to the Carousell inbox and stay idle to check for new messages or replies from sellers.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "take_screenshot",
-                    "description": "Take a screenshot of the current browser page.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "filename": {
-                                "type": "string",
-                                "description": "Optional filename for the screenshot"
-                            }
-                        },
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "send_voice_message",
-                    "description": "Record audio from microphone, transcribe using Gemini AI, and send the message to the current chat.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "duration": {
-                                "type": "integer",
-                                "description": "Recording duration in seconds (default: 10)"
-                            }
-                        },
-                        "required": []
-                    }
-                }
-            },
-        ]
+    # Per-session state
+    
+    @property
+    def _session(self) -> dict:
+        """State of the session being served (the default session outside run())."""
+        session = _SESSION.get(None)
+        return self._sessions["default"] if session is None else session
+    
+    @property
+    def current_listings(self) -> list[dict]:
+        """Listings from the session's last search/extract."""
+        return self._session["listings"]
+    
+    @current_listings.setter
+    def current_listings(self, listings: list[dict]):
+        session = self._session
+        session["listings"] = listings
+        session["by_index"] = {l.get("index", i): l for i, l in enumerate(listings)}
+        session["by_id"] = {l["listing_id"]: l for l in listings if l.get("listing_id")}
+    
+    @property
+    def committed_prefix(self) -> list[dict]:
+        """Stable history (summaries) sent right after the system prompt."""
+        return self._session["prefix"]
+    
+    @committed_prefix.setter
+    def committed_prefix(self, messages: list[dict]):
+        self._session["prefix"] = messages
+    
+    @property
+    def recent_tail(self) -> list[dict]:
+        """Recent turns, compacted into the prefix over time."""
+        return self._session["tail"]
+    
+    def _resolve(
+        self, listing_index: Optional[int] = None, listing_id: Optional[str] = None
+    ) -> tuple[Optional[dict], Optional[ToolResult]]:
+        """
+        Look up a listing by stable id or displayed index.
+        
+        Args:
+            listing_index: Index shown in the listings display
+            listing_id: Stable listing id (takes precedence)
+            
+        Returns:
+            (listing, None) on success, or (None, failure ToolResult)
+        """
+        if not self.current_listings:
+            return None, _failure("No listings available. Search first.")
+        
+        if listing_id is not None:
+            listing = self._session["by_id"].get(str(listing_id))
+            if listing is None:
+                return None, _failure(f"Unknown listing id {listing_id}. Search or extract listings again.")
+            return listing, None
+        
+        if listing_index is None:
+            return None, _failure("Provide listing_index or listing_id.")
+        
+        by_index = self._session["by_index"]
+        listing = by_index.get(int(listing_index))
+        if listing is None:
+            valid = ", ".join(map(str, by_index))
+            return None, _failure(f"Invalid listing index. Valid indexes: {valid}")
+        return listing, None
     
     def _define_tool_handlers(self) -> dict[str, Callable]:
         """Map tool names to handler functions."""
@@ -189,6 +1272,7 @@ class ControllerAgent:
             "search_carousell": self._handle_search,
             "extract_listings": self._handle_extract,
             "open_listing": self._handle_open_listing,
+            "compare_listings": self._handle_compare_listings,
             "open_chat": self._handle_open_chat,
             "delegate_lowball": self._handle_delegate_lowball,
             "check_chat": self._handle_check_chat,
@@ -196,101 +1280,344 @@ class ControllerAgent:
             "send_voice_message": self._handle_voice_message,
         }
     
-    async def run(self, user_prompt: str) -> str:
+    async def run(self, user_prompt: str, session_id: str = "default") -> str:
         """
         Process a user prompt through the agent loop.
         
         Args:
             user_prompt: The user's command or question
+            session_id: Conversation to continue (listings and history are per session)
             
         Returns:
             Agent's response string
         """
+        return "\n".join([chunk async for chunk in self.run_stream(user_prompt, session_id)])
+    
+    async def run_stream(self, user_prompt: str, session_id: str = "default") -> AsyncIterator[str]:
+        """
+        Process a user prompt, yielding output as it becomes available.
+        
+        Each tool result line is yielded as soon as that tool finishes, followed
+        by the LLM's final text reply.
+        
+        Args:
+            user_prompt: The user's command or question
+            session_id: Conversation to continue (listings and history are per session)
+            
+        Yields:
+            Tool result lines, then the response text
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _new_session()
+        
+        token = _SESSION.set(session)
+        try:
+            async for chunk in self._run_session(user_prompt):
+                yield chunk
+        finally:
+            try:
+                _SESSION.reset(token)
+            except ValueError:
+                pass  # Generator finalized from another context; that context is gone anyway
+    
+    async def _run_session(self, user_prompt: str) -> AsyncIterator[str]:
+        """Agent loop for run_stream, with the session already bound in _SESSION."""
         print(f"\nCONTROLLER: Processing → '{user_prompt}'")
         
         # Add user message to history
-        self.conversation_history.append({
+        self.recent_tail.append({
             "role": "user",
             "content": user_prompt
         })
+        await self._compact_history()
+        
+        # Tool-calling loop: results go back to the LLM until it answers in text
+        streaming = getattr(self.llm, "complete_streaming", None)
+        for _ in range(_MAX_TOOL_ROUNDS):
+            batch = None
+            if streaming:
+                # Each tool starts as soon as its call is decoded, overlapping the rest of the stream
+                batch = _ToolBatch(self, confirmed=False)
+                try:
+                    response = await streaming(self._build_messages(), tools=self.tools, on_tool_call=batch.start)
+                except BaseException:
+                    # Stream failed or was cancelled: drop the calls it started (frees the lock)
+                    await asyncio.shield(batch.abort())
+                    raise
+                batch.confirm(accepted=not response.get("error"))
+            else:
+                response = await self.llm.complete(self._build_messages(), tools=self.tools)
+            
+            if not response.get("tool_calls"):
+                break
+            async for line in self._execute_tool_calls(response["tool_calls"], response.get("content"), batch):
+                yield line
+        else:
+            print(f"CONTROLLER: Stopping after {_MAX_TOOL_ROUNDS} tool rounds")
+            return
         
-        # Build messages for LLM
-        messages = self._build_messages()
-        
-        # Get LLM response with potential tool calls
-        response = await self.llm.complete(messages, tools=self.tools)
-        
-        # Handle tool calls if present
-        if response.get("tool_calls"):
-            return await self._execute_tool_calls(response["tool_calls"])
-        
-        # Otherwise, return the content response
+        # Final text response
         content = response.get("content", "I'm not sure how to help with that.")
-        self.conversation_history.append({
+        self.recent_tail.append({
             "role": "assistant",
             "content": content
         })
-        
-        return content
+        if content:
+            yield content
     
     def _build_messages(self) -> list[dict]:
-        """Build the message list for the LLM."""
-        system_message = {
-            "role": "system",
-            "content": """You are Carousell Lowballer, an AI assistant that helps users find and negotiate deals on Carousell Singapore.
-
-You have access to these tools:
-- search_carousell(query, max_price): Search for items
-- extract_listings(): Get current listings from page
-- open_listing(listing_index): View a specific listing
-- open_chat(listing_index): Open chat with seller
-- delegate_lowball(listing_index): Start negotiation
-- send_voice_message(duration): Record voice, transcribe, and send to chat
-- check_chat(): Go to inbox and stay updated
-- take_screenshot(): Capture current page
-
-When the user asks to find items, use search_carousell first, then extract_listings to show results.
-When they want to negotiate, use delegate_lowball to start the lowball negotiation.
-When they want to send a voice message, use send_voice_message to record and send.
-When they want to check messages or see what sellers said, use check_chat.
-
-Be helpful, proactive, and explain what you're doing."""
-        }
+        """
+        Build the message list for the LLM.
+        
+        Ordered for prompt caching: the system prompt and committed history form a
+        byte-stable prefix that only ever grows, followed by the recent tail.
+        Providers cache tools → system → messages, so the breakpoint on the system
+        message also covers the tool schemas; any change to self.tools or
+        self._system_message invalidates every cached prefix.
+        """
+        prefix = [self._system_message, *self.committed_prefix]
         
-        return [system_message] + self.conversation_history[-10:]  # Keep last 10 messages
+        if self._cache_control and len(prefix) > 1:
+            # Mark the end of the stable prefix so the provider caches it
+            prefix[-1] = _with_cache_control(prefix[-1])
+        
+        return [*prefix, *self.recent_tail]
+    
+    @property
+    def conversation_history(self) -> list[dict]:
+        """Full conversation as sent to the LLM (committed prefix + recent tail)."""
+        return [*self.committed_prefix, *self.recent_tail]
+    
+    def _supports_cache_control(self) -> bool:
+        """Whether the provider honours explicit cache_control breakpoints (Anthropic)."""
+        model = getattr(self.llm, "model", "") or ""
+        return model.startswith("anthropic/") or "claude" in model
+    
+    async def _compact_history(self):
+        """
+        Fold older tail messages into a summary appended to the committed prefix.
+        
+        The prefix only grows between folds, so cached prefix tokens stay valid; it is
+        rewritten only when it exceeds _PREFIX_MAX_SUMMARIES summaries.
+        """
+        if (
+            len(self.recent_tail) <= _TAIL_MAX_MESSAGES
+            and sum(len(m.get("content") or "") for m in self.recent_tail) <= _TAIL_MAX_CHARS
+        ):
+            return
+        
+        # Cut at a user message so the kept tail starts a fresh exchange; an assistant
+        # tool_calls message and its tool replies are never split (the provider rejects
+        # orphans). A single turn has no cut point and stays whole, bounded by _MAX_TOOL_ROUNDS.
+        cut = len(self.recent_tail) - _TAIL_KEEP_MESSAGES
+        while cut > 0 and self.recent_tail[cut]["role"] != "user":
+            cut -= 1
+        if cut <= 0:
+            return
+        
+        old = self.recent_tail[:cut]
+        del self.recent_tail[:cut]
+        summary = await self._summarize(old)
+        
+        # Appended as a user/assistant pair so roles keep alternating
+        self.committed_prefix.append({"role": "user", "content": "Summarize our conversation so far."})
+        self.committed_prefix.append({"role": "assistant", "content": summary})
+        print(f"CONTROLLER: Compacted {len(old)} older messages into history summary")
+        
+        if len(self.committed_prefix) > 2 * _PREFIX_MAX_SUMMARIES:
+            # Bound memory: fold all summaries into one (invalidates the cached prefix once)
+            merged = await self._summarize(self.committed_prefix)
+            self.committed_prefix = [
+                {"role": "user", "content": "Summarize our conversation so far."},
+                {"role": "assistant", "content": merged},
+            ]
+            print("CONTROLLER: Folded history summaries into one")
     
-    async def _execute_tool_calls(self, tool_calls: list[dict]) -> str:
-        """Execute tool calls and return combined results."""
-        results = []
+    async def _summarize(self, messages: list[dict]) -> str:
+        """
+        Summarize messages with the LLM, falling back to the raw transcript tail.
         
-        for tc in tool_calls:
-            tool_name = tc.get("name")
-            arguments = tc.get("arguments", {})
+        Args:
+            messages: Messages to summarize
             
-            print(f"CONTROLLER: Executing tool '{tool_name}' with args: {arguments}")
+        Returns:
+            Summary text
+        """
+        transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in messages)
+        
+        response = await self.llm.complete(
+            [
+                {"role": "system", "content": _SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            max_tokens=256,
+        )
+        summary = (response.get("content") or "").strip()
+        if not summary or response.get("error"):
+            summary = transcript[-1500:]  # Fallback: keep the most recent raw context
+        return summary
+    
+    async def _execute_tool_calls(
+        self,
+        tool_calls: list[dict],
+        content: Optional[str] = None,
+        batch: Optional[_ToolBatch] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Execute tool calls and record them in history as tool-calling messages.
+        
+        All calls are dispatched concurrently (see _ToolBatch).
+        
+        Args:
+            tool_calls: Tool calls from the LLM response
+            content: Any text the LLM returned alongside the calls
+            batch: Batch already running the leading calls (streamed responses)
             
-            handler = self.tool_handlers.get(tool_name)
-            if handler:
-                try:
-                    result = await handler(**arguments)
-                    results.append(f"✓ {tool_name}: {result}")
-                except Exception as e:
-                    results.append(f"✗ {tool_name}: Error - {e}")
-            else:
-                results.append(f"✗ Unknown tool: {tool_name}")
+        Yields:
+            One summary line per call, in completion order
+        """
+        if batch is None:
+            batch = _ToolBatch(self, tuple(tc.get("name") for tc in tool_calls))
+        # Start whatever the stream did not already hand over (e.g. content-parsed calls)
+        for tc in tool_calls[batch.received:]:
+            batch.start(tc)
+        
+        async for result in batch.as_completed():
+            yield _format_result(result)
         
-        combined_result = "\n".join(results)
+        call_ids = [tc.get("id") or f"call_{i}" for i, tc in enumerate(batch.calls)]
         
-        # Add to conversation history
-        self.conversation_history.append({
+        # Assistant turn carrying the calls, then one tool message per result
+        self.recent_tail.append({
             "role": "assistant",
-            "content": combined_result
+            "content": content or None,
+            "tool_calls": [
+                {
+                    "id": call_id,
+                    "type": "function",
+                    "function": {"name": tc.get("name"), "arguments": _json_dumps(tc["arguments"])},
+                }
+                for call_id, tc in zip(call_ids, batch.calls)
+            ],
         })
+        self.recent_tail.extend(
+            {
+                "role": "tool",
+                "tool_call_id": call_id,
+                "name": result["tool"],
+                "content": _truncate(_json_dumps(result)),
+            }
+            for call_id, result in zip(call_ids, batch.results)
+        )
+    
+    def _is_read_only(self, tool_name: Optional[str], batch_names: set) -> bool:
+        """
+        Whether a tool call can safely overlap with other calls in the same turn.
+        
+        Anything that looks at the page counts as mutating: take_screenshot must
+        queue behind earlier navigations in the batch, or it captures the old page.
+        """
+        if not config.agent.parallel_tool_calls:
+            return False
+        # extract_listings only reads cached listings, unless a search this turn replaces them
+        return (
+            tool_name == "extract_listings"
+            and bool(self.current_listings)
+            and "search_carousell" not in batch_names
+        )
+    
+    def _use_worker_tab(self, tool_name: Optional[str], batch_names: set) -> bool:
+        """Whether a mutating call should take the worker tab rather than wait for the main page."""
+        return (
+            config.agent.parallel_tool_calls
+            and tool_name in _WORKER_TAB_TOOLS
+            and self._browser_lock.locked()
+            and not batch_names & _LISTING_TOOLS
+        )
+    
+    @asynccontextmanager
+    async def _worker_tab(self):
+        """Run the enclosed tool call in the worker tab (one call at a time)."""
+        async with self._worker_lock:
+            if self._worker_page is None or self._worker_page.is_closed():
+                self._worker_page = await self.browser.new_context_page()
+            token = _TAB.set(self._worker_page)
+            try:
+                yield self._worker_page
+            finally:
+                _TAB.reset(token)
+    
+    @property
+    def _active_page(self) -> Optional["Page"]:
+        """Page the current tool call works on: its worker tab, else the shared main page."""
+        return _TAB.get() or self.browser.get_page()
+    
+    async def _navigate(self, url: str, page: Optional["Page"] = None) -> bool:
+        """
+        Navigate a page to `url`.
         
-        return combined_result
+        The main page (default) goes through BrowserLoader for its popup/redirect
+        handling, under _nav_lock so the popup monitor stays off it meanwhile.
+        """
+        if page is None or page is self.browser.get_page():
+            async with self._nav_lock:
+                return await self.browser.navigate(url)
+        try:
+            await page.goto(url, wait_until="domcontentloaded")
+            return True
+        except Exception as e:
+            print(f"CONTROLLER: Worker tab navigation failed → {e}")
+            return False
+    
+    async def _invoke(self, tc: dict) -> ToolResult:
+        """Run a single tool call and return its ToolResult."""
+        tool_name = tc.get("name")
+        arguments = tc["arguments"]
+        
+        print(f"CONTROLLER: Executing tool '{tool_name}' with args: {arguments}")
+        
+        handler = self._dispatch(tool_name)
+        if not handler:
+            return {"ok": False, "tool": tool_name, "data": None, "message": "Unknown tool"}
+        params = self._handler_params[tool_name]
+        if not params.issuperset(arguments):
+            # Drop arguments the model invented rather than failing the call
+            arguments = {k: v for k, v in arguments.items() if k in params}
+        try:
+            result = await handler(**arguments)
+        except Exception as e:
+            return {"ok": False, "tool": tool_name, "data": None, "message": f"Error - {e}"}
+        result["tool"] = tool_name
+        return result
     
     # Popup Management
     
+    async def _popup_helper(self, page, name: str, arg: Any = None) -> Any:
+        """
+        Call one of the window.__* popup helpers, installing them on first use.
+        
+        Args:
+            page: Playwright page
+            name: Helper name (__detectPopup, __dismissPopup, __dismissPopupRetry or __popupDirty)
+            arg: Optional argument passed to the helper
+            
+        Returns:
+            The helper's return value
+        """
+        context = page.context
+        if context not in self._popup_helper_contexts:
+            # Every future document in the context (any page or tab) gets the helpers
+            await context.add_init_script(_POPUP_HELPERS_JS)
+            self._popup_helper_contexts.add(context)
+        
+        result = await page.evaluate(_CALL_POPUP_HELPER_JS, [name, arg])
+        if result == "__missing__":
+            # Current document predates the init script
+            await page.evaluate(_POPUP_HELPERS_JS)
+            result = await page.evaluate(_CALL_POPUP_HELPER_JS, [name, arg])
+        return result
+    
     async def dismiss_popups(self, grace_period: float = 0.2, max_attempts: int = 2) -> bool:
         """
         Fast popup dismissal: Check for popup, click X immediately.
@@ -303,283 +1630,86 @@ Be helpful, proactive, and explain what you're doing."""
         Returns:
             True if popup was dismissed, False otherwise
         """
-        page = self.browser.get_page()
+        page = self._active_page
         if not page:
             return False
         
+        # Same page came up clean moments ago: skip the re-scan (navigation resets this)
+        checked_at, checked_url = self._last_popup_clear
+        if page.url == checked_url and time.monotonic() - checked_at < _POPUP_CHECK_COOLDOWN:
+            return False
+        
         # Wait for popup to appear
         if grace_period > 0:
             await asyncio.sleep(grace_period)
         
-        for attempt in range(max_attempts):
+        async with self._popup_lock:
             try:
-                # Stricter popup detection - only real modals/overlays
-                popup_info = await page.evaluate("""
-                    () => {
-                        // Find dialogs - must be visible and cover significant area
-                        const dialogs = document.querySelectorAll('[role="dialog"]');
-                        for (let d of dialogs) {
-                            const style = window.getComputedStyle(d);
-                            if (style.display === 'none' || style.visibility === 'hidden' || style.opacity === '0') continue;
-                            
-                            const rect = d.getBoundingClientRect();
-                            // Must cover at least 30% of viewport to be considered a blocking popup
-                            const viewportArea = window.innerWidth * window.innerHeight;
-                            const dialogArea = rect.width * rect.height;
-                            if (dialogArea > viewportArea * 0.3 && rect.width > 200 && rect.height > 200) {
-                                return { found: true, type: 'dialog' };
-                            }
-                        }
-                        
-                        // Find high z-index overlays - must be very large
-                        const all = document.querySelectorAll('*');
-                        for (let el of all) {
-                            const style = window.getComputedStyle(el);
-                            const zIndex = parseInt(style.zIndex) || 0;
-                            if (zIndex >= 1000 && style.display !== 'none' && style.visibility !== 'hidden') {
-                                const rect = el.getBoundingClientRect();
-                                const viewportArea = window.innerWidth * window.innerHeight;
-                                const elementArea = rect.width * rect.height;
-                                // Must cover at least 40% of viewport
-                                if (elementArea > viewportArea * 0.4 && rect.width > 300 && rect.height > 300) {
-                                    return { found: true, type: 'overlay', zIndex: zIndex };
-                                }
-                            }
-                        }
-                        
-                        return { found: false };
-                    }
-                """)
-                
-                if not popup_info.get('found'):
-                    return False  # No popup found, exit immediately
-                
-                # Popup found, try to dismiss
-                # Strategy 1: Try Playwright locators (fastest)
-                x_selectors = [
-                    'button:has-text("×")',
-                    'button:has-text("✕")',
-                    'button[aria-label="Close"]',
-                    'button[aria-label="close"]',
-                    'svg[aria-label="Close"]',
-                ]
-                
-                for selector in x_selectors:
-                    try:
-                        locator = page.locator(selector).first
-                        if await locator.is_visible(timeout=300):
-                            await locator.click(timeout=500)
-                            return True
-                    except Exception:
-                        continue
-                
-                # Strategy 2: JavaScript-based click (fixed SVG handling)
-                clicked = await page.evaluate("""
-                    () => {
-                        // Helper to safely get className (handles SVGAnimatedString)
-                        const getClassName = (el) => {
-                            if (!el || !el.className) return '';
-                            if (typeof el.className === 'string') return el.className;
-                            if (el.className.baseVal !== undefined) {
-                                const baseVal = el.className.baseVal;
-                                return typeof baseVal === 'string' ? baseVal : String(baseVal);
-                            }
-                            return String(el.className);
-                        };
-                        
-                        // Find all buttons and check for X/close
-                        const buttons = document.querySelectorAll('button, [role="button"]');
-                        for (let btn of buttons) {
-                            const style = window.getComputedStyle(btn);
-                            if (style.display === 'none' || style.visibility === 'hidden') continue;
-                            
-                            const text = (btn.innerText || btn.textContent || '').trim();
-                            const ariaLabel = (btn.getAttribute('aria-label') || '').toLowerCase();
-                            const className = getClassName(btn).toLowerCase();
-                            
-                            // Check if it's an X button
-                            if ((text === '×' || text === '✕' || text === '✖' || 
-                                 ariaLabel === 'close' || ariaLabel.includes('close') ||
-                                 className.includes('close')) &&
-                                !text.toLowerCase().includes('continue') &&
-                                !text.toLowerCase().includes('next') &&
-                                !ariaLabel.includes('continue')) {
-                                
-                                const rect = btn.getBoundingClientRect();
-                                if (rect.width > 0 && rect.height > 0) {
-                                    btn.click();
-                                    return true;
-                                }
-                            }
-                        }
-                        
-                        // Check SVG icons (with proper className handling)
-                        const svgs = document.querySelectorAll('svg');
-                        for (let svg of svgs) {
-                            const style = window.getComputedStyle(svg);
-                            if (style.display === 'none') continue;
-                            
-                            const ariaLabel = (svg.getAttribute('aria-label') || '').toLowerCase();
-                            const className = getClassName(svg).toLowerCase();
-                            
-                            if (ariaLabel.includes('close') || className.includes('close')) {
-                                const parent = svg.closest('button, [role="button"], a, div, span');
-                                if (parent) {
-                                    parent.click();
-                                    return true;
-                                }
-                            }
-                        }
-                        
-                        return false;
-                    }
-                """)
-                
-                if clicked:
-                    return True
-                
-                # Strategy 3: ESC key (only on second attempt)
-                if attempt >= 1:
-                    try:
-                        await page.keyboard.press("Escape")
-                        await asyncio.sleep(0.1)
-                        return True
-                    except Exception:
-                        pass
-                
-                # Brief wait before next attempt
-                if attempt < max_attempts - 1:
-                    await asyncio.sleep(0.2)
-                    
+                # Detect (only real modals/overlays) and click close controls, retrying in-page
+                result = await self._popup_helper(page, "__dismissPopupRetry", max_attempts)
             except Exception:
-                # Silently continue - don't spam errors for false positives
-                if attempt < max_attempts - 1:
-                    await asyncio.sleep(0.1)
-        
-        return False
+                return False  # Silently give up - don't spam errors for false positives
+            
+            if not result:
+                return False
+            if result.get("dismissed"):
+                return True
+            
+            # Fallback: ESC key (only once the JS click has failed twice)
+            if result.get("stuck"):
+                try:
+                    await page.keyboard.press("Escape")
+                    # Done as soon as the popup is gone; still up after 500ms means Escape didn't work
+                    await page.wait_for_function(_POPUP_CLOSED_JS, polling=50, timeout=500)
+                    return True
+                except Exception:
+                    pass
+                return False
+            
+            # Nothing to dismiss
+            self._last_popup_clear = (time.monotonic(), page.url)
+            return False
     
-    async def debug_popups(self) -> str:
+    def _dismiss_popups_in_background(self):
+        """Check for popups without blocking the caller (the in-page observer handles later ones)."""
+        task = asyncio.ensure_future(self.dismiss_popups(grace_period=0))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def debug_popups(self, full_scan: bool = False) -> str:
         """
         Debug function to inspect what popups/overlays are currently on the page.
         Returns a detailed report of potential popups.
+        
+        Args:
+            full_scan: Check the computed z-index of every element, not just likely
+                popup candidates (slow on large pages)
         """
         page = self.browser.get_page()
         if not page:
             return "Browser not ready"
         
         try:
-            js_debug = """
-            () => {
-                const report = {
-                    dialogs: [],
-                    highZIndex: [],
-                    closeButtons: [],
-                    overlays: []
-                };
-                
-                // Find dialogs
-                const dialogs = document.querySelectorAll('[role="dialog"]');
-                dialogs.forEach((d, i) => {
-                    const style = window.getComputedStyle(d);
-                    report.dialogs.push({
-                        index: i,
-                        visible: style.display !== 'none',
-                        zIndex: style.zIndex,
-                        className: d.className,
-                        id: d.id
-                    });
-                });
-                
-                // Find high z-index elements
-                const allElements = document.querySelectorAll('*');
-                for (let el of allElements) {
-                    const style = window.getComputedStyle(el);
-                    const zIndex = parseInt(style.zIndex) || 0;
-                    if (zIndex >= 1000 && style.display !== 'none') {
-                        const rect = el.getBoundingClientRect();
-                        if (rect.width > 100 && rect.height > 100) {
-                            report.highZIndex.push({
-                                tag: el.tagName,
-                                zIndex: zIndex,
-                                className: el.className.substring(0, 50),
-                                id: el.id,
-                                size: `${Math.round(rect.width)}x${Math.round(rect.height)}`
-                            });
-                        }
-                    }
-                }
-                
-                // Find potential close buttons
-                const buttons = document.querySelectorAll('button, [role="button"]');
-                buttons.forEach((btn, i) => {
-                    const style = window.getComputedStyle(btn);
-                    if (style.display !== 'none') {
-                        const text = (btn.innerText || '').trim();
-                        const ariaLabel = btn.getAttribute('aria-label') || '';
-                        const className = btn.className || '';
-                        if (text.toLowerCase().includes('close') || 
-                            text === '×' || text === '✕' || text === '✖' ||
-                            ariaLabel.toLowerCase().includes('close') ||
-                            className.toLowerCase().includes('close')) {
-                            report.closeButtons.push({
-                                index: i,
-                                text: text,
-                                ariaLabel: ariaLabel,
-                                className: className.substring(0, 50),
-                                visible: style.display !== 'none'
-                            });
-                        }
-                    }
-                });
-                
-                // Find overlays/modals by class
-                const overlaySelectors = [
-                    '[class*="modal"]',
-                    '[class*="overlay"]',
-                    '[class*="popup"]',
-                    '[class*="Modal"]',
-                    '[class*="Overlay"]'
-                ];
-                
-                overlaySelectors.forEach(selector => {
-                    try {
-                        const els = document.querySelectorAll(selector);
-                        els.forEach(el => {
-                            const style = window.getComputedStyle(el);
-                            if (style.display !== 'none') {
-                                report.overlays.push({
-                                    selector: selector,
-                                    className: el.className.substring(0, 50),
-                                    id: el.id,
-                                    zIndex: style.zIndex
-                                });
-                            }
-                        });
-                    } catch(e) {}
-                });
-                
-                return report;
-            }
-            """
-            
-            result = await page.evaluate(js_debug)
+            result = await page.evaluate(_DEBUG_POPUPS_JS, full_scan)
             
+            # Entry lists arrive already capped in-page; counts are the full totals
+            counts = result["counts"]
             report_lines = ["=== POPUP DEBUG REPORT ==="]
-            report_lines.append(f"Dialogs found: {len(result.dialogs)}")
-            for d in result.dialogs:
-                report_lines.append(f"  - Dialog {d.index}: visible={d.visible}, zIndex={d.zIndex}, class={d.className[:30]}")
+            report_lines.append(f"Dialogs found: {counts['dialogs']}")
+            for d in result["dialogs"]:
+                report_lines.append(f"  - Dialog {d['index']}: visible={d['visible']}, zIndex={d['zIndex']}, class={d['className']}")
             
-            report_lines.append(f"\nHigh z-index elements (>=1000): {len(result.highZIndex)}")
-            for z in result.highZIndex[:5]:  # Limit to first 5
-                report_lines.append(f"  - {z.tag}: zIndex={z.zIndex}, size={z.size}, class={z.className}")
+            report_lines.append(f"\nHigh z-index elements (>=1000): {counts['highZIndex']}")
+            for z in result["highZIndex"]:
+                report_lines.append(f"  - {z['tag']}: zIndex={z['zIndex']}, size={z['size']}, class={z['className']}")
             
-            report_lines.append(f"\nClose buttons found: {len(result.closeButtons)}")
-            for cb in result.closeButtons[:10]:  # Limit to first 10
-                report_lines.append(f"  - Text: '{cb.text}', ariaLabel: '{cb.ariaLabel}', visible: {cb.visible}")
+            report_lines.append(f"\nClose buttons found: {counts['closeButtons']}")
+            for cb in result["closeButtons"]:
+                report_lines.append(f"  - Text: '{cb['text']}', ariaLabel: '{cb['ariaLabel']}', visible: {cb['visible']}")
             
-            report_lines.append(f"\nOverlays found: {len(result.overlays)}")
-            for ov in result.overlays[:5]:  # Limit to first 5
-                report_lines.append(f"  - {ov.selector}: class={ov.className}, zIndex={ov.zIndex}")
+            report_lines.append(f"\nOverlays found: {counts['overlays']}")
+            for ov in result["overlays"]:
+                report_lines.append(f"  - {ov['match']}: class={ov['className']}, zIndex={ov['zIndex']}")
             
             report = "\n".join(report_lines)
             print(report)
@@ -590,34 +1720,75 @@ Be helpful, proactive, and explain what you're doing."""
             print(error_msg)
             return error_msg
     
-    async def _start_popup_monitor(self, interval: float = 2.0):
+    async def _start_popup_monitor(self, interval: float = 2.0, backoff: float = 10.0):
         """
-        Background task that periodically checks for and dismisses popups.
+        Background task that dismisses popups as they appear.
+        
+        Checks in the page (wait_for_function polling every `interval` seconds)
+        until the DOM has changed and a popup is showing, so an idle page costs
+        no round-trips; the wait survives navigations. After a failed dismissal
+        the next check is delayed by a doubling backoff (up to _POPUP_MONITOR_MAX_INTERVAL).
         
         Args:
             interval: Seconds between popup checks (default 2.0 for faster checks)
+            backoff: Base seconds to wait after a failed dismissal
         """
-        while True:
-            try:
-                result = await self.dismiss_popups(grace_period=0.1)  # Minimal grace period
-                if result:
+        miss_streak = 0
+        try:
+            while True:
+                page = self.browser.get_page()
+                attempted = dismissed = False
+                try:
+                    if not page:
+                        await asyncio.sleep(interval)
+                        continue
+                    # Also installs the helpers into the current document on first use
+                    detected = await self._popup_helper(page, "__detectPopup")
+                    if not (detected or {}).get("found"):
+                        # Bounded so a replaced page is picked up
+                        await page.wait_for_function(
+                            _POPUP_PENDING_JS,
+                            polling=int(interval * 1000),
+                            timeout=_POPUP_MONITOR_MAX_INTERVAL * 1000,
+                        )
+                    if self._popup_lock.locked() or self._nav_lock.locked():
+                        # A tool call is already dismissing this popup, or the page is being
+                        # replaced (the navigation clears popups itself); look again after it
+                        await asyncio.sleep(interval)
+                        continue
+                    attempted = True
+                    dismissed = await self.dismiss_popups(grace_period=0.1)  # Minimal grace period
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # Timed out with nothing to do, or the page navigated/closed mid-check;
+                    # a change in the meantime stays flagged, so nothing is missed
+                    await asyncio.sleep(interval)
+                    continue
+                
+                if dismissed:
                     print("CONTROLLER: 🔔 Background popup monitor dismissed a popup")
-                await asyncio.sleep(interval)
-            except asyncio.CancelledError:
-                break
-            except Exception:
-                # Continue monitoring even if one check fails
-                await asyncio.sleep(interval)
+                    miss_streak = 0
+                elif attempted:
+                    # Popup we cannot close: don't hammer it
+                    miss_streak = min(miss_streak + 1, 10)
+                    await asyncio.sleep(min(backoff * (2 ** (miss_streak - 1)), _POPUP_MONITOR_MAX_INTERVAL))
+        except asyncio.CancelledError:
+            pass
     
-    def start_popup_monitoring(self, interval: float = 3.0):
+    def start_popup_monitoring(self, interval: float = 3.0, backoff: float = 10.0):
         """
         Start background popup monitoring.
         
+        Popups are normally closed in-page by the auto-dismiss observer; this
+        monitor is the safety net for ones it could not close.
+        
         Args:
             interval: Seconds between popup checks (default: 3.0)
+            backoff: Base seconds to wait after a failed dismissal, doubling per miss (default: 10.0)
         """
         if self._popup_check_task is None or self._popup_check_task.done():
-            self._popup_check_task = asyncio.create_task(self._start_popup_monitor(interval))
+            self._popup_check_task = asyncio.create_task(self._start_popup_monitor(interval, backoff))
             print(f"CONTROLLER: Started background popup monitoring (interval: {interval}s)")
     
     def stop_popup_monitoring(self):
@@ -626,245 +1797,322 @@ Be helpful, proactive, and explain what you're doing."""
             self._popup_check_task.cancel()
             print("CONTROLLER: Stopped background popup monitoring")
     
+    async def close(self):
+        """Stop background work and close the worker tab (call before browser.close())."""
+        self.stop_popup_monitoring()
+        async with self._worker_lock:  # Let a running worker-tab call finish first
+            if self._worker_page is not None and not self._worker_page.is_closed():
+                await self._worker_page.close()
+            self._worker_page = None
+    
     # Tool Handlers
     
-    async def _handle_search(self, query: str, max_price: Optional[float] = None) -> str:
+    async def _handle_search(self, query: str, max_price: Optional[float] = None) -> ToolResult:
         """Handle search_carousell tool."""
         page = self.browser.get_page()
         if not page:
-            return "Browser not ready. Please ensure browser is launched."
+            return _failure("Browser not ready. Please ensure browser is launched.")
         
-        # Format search URL
-        formatted_query = query.replace(" ", "%20")
-        search_url = f"https://www.carousell.sg/search/{formatted_query}"
+        search_url = _search_url(query, int(max_price) if max_price else None)
         
         print(f"CONTROLLER: Searching Carousell for '{query}'...")
         
-        success = await self.browser.navigate(search_url)
-        if not success:
-            return f"Failed to navigate to search results for '{query}'"
-        
-        # Dismiss popups after navigation (they appear after page load)
-        await self.dismiss_popups(grace_period=0.3, max_attempts=2)
-        
-        # Extract listings
-        dom_data = await extract_dom(page)
-        self.current_listings = parse_listings(dom_data)
-        
-        # Apply price filter if specified
-        if max_price:
-            self.current_listings = filter_listings_by_price(self.current_listings, max_price)
+        cache_key = (search_url, max_price)
+        cached = self._search_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < _SEARCH_CACHE_TTL:
+            # Repeat search: reuse parsed listings, only navigate so the visible browser matches
+            self._search_cache.move_to_end(cache_key)
+            self.current_listings = cached[1]
+            print(f"CONTROLLER: Using cached results for '{query}'")
+            if page.url.rstrip("/") != search_url:
+                await self._navigate(search_url)
+        else:
+            success = await self._navigate(search_url)
+            if not success:
+                return _failure(f"Failed to navigate to search results for '{query}'")
+            
+            # Wait for the cards the extractor reads, then clear popups
+            await _wait_for_dom(page)
+            await _wait_for_selector(page, _LISTING_CARD_SELECTOR)
+            await self.dismiss_popups(grace_period=0.3, max_attempts=2)
+
+            extract_dom = _load_extract_dom()
+            dom_parser = _load_dom_parser()
+            
+            # Extract listings
+            dom_data = await extract_dom(page)
+            listings = await asyncio.to_thread(dom_parser.parse_listings, dom_data)
+            
+            # Apply price filter if specified (safety net if the server ignored price_end)
+            if max_price:
+                listings = dom_parser.filter_listings_by_price(listings, max_price)
+            self.current_listings = listings
+            
+            if self.current_listings:
+                self._search_cache[cache_key] = (time.monotonic(), self.current_listings)
+                if len(self._search_cache) > _SEARCH_CACHE_SIZE:
+                    self._search_cache.popitem(last=False)  # Evict least recently used
         
         # Auto-display listings
+        price_note = f" under ${max_price}" if max_price else ""
         if self.current_listings:
-            display = format_listings_for_display(self.current_listings)
-            print(display)
-            return f"Found {len(self.current_listings)} listings for '{query}'" + (f" under ${max_price}" if max_price else "") + " (displayed above)"
+            print(self._display_listings())
+            return _success(
+                f"Found {len(self.current_listings)} listings for '{query}'{price_note} (displayed above)",
+                data=_listing_summaries(self.current_listings),
+            )
         else:
-            return f"No listings found for '{query}'" + (f" under ${max_price}" if max_price else "")
+            return _success(f"No listings found for '{query}'{price_note}", data=[])
     
-    async def _handle_extract(self) -> str:
+    async def _handle_extract(self) -> ToolResult:
         """Handle extract_listings tool."""
-        # Dismiss any popups before extracting
-        await self.dismiss_popups(grace_period=0.2)
+        # Reading the DOM isn't blocked by popups: clear them without waiting
+        self._dismiss_popups_in_background()
         
-        if not self.current_listings:
+        cached = bool(self.current_listings)
+        if not cached:
             page = self.browser.get_page()
             if page:
-                dom_data = await extract_dom(page)
-                self.current_listings = parse_listings(dom_data)
+                dom_data = await _load_extract_dom()(page)
+                self.current_listings = await asyncio.to_thread(_load_dom_parser().parse_listings, dom_data)
         
         if not self.current_listings:
-            return "No listings found. Try searching first."
+            return _failure("No listings found. Try searching first.")
         
-        display = format_listings_for_display(self.current_listings)
-        print(display)
-        return f"Extracted {len(self.current_listings)} listings (displayed above)"
+        count = len(self.current_listings)
+        print(self._display_listings())
+        return _success(
+            (f"Using {count} cached listings" if cached else f"Extracted {count} listings") + " (displayed above)",
+            data=_listing_summaries(self.current_listings),
+        )
     
-    async def _handle_open_listing(self, listing_index: int) -> str:
+    def _display_listings(self) -> str:
+        """Formatted listings for the CLI, reformatted only when current_listings changes."""
+        session = self._session
+        if session["display"] is None or session["display"][0] is not session["listings"]:
+            display = _load_dom_parser().format_listings_for_display(session["listings"])
+            session["display"] = (session["listings"], display)
+        return session["display"][1]
+    
+    async def _handle_open_listing(self, listing_index: Optional[int] = None, listing_id: Optional[str] = None) -> ToolResult:
         """Handle open_listing tool."""
-        # Dismiss any popups before opening listing
-        await self.dismiss_popups(grace_period=0.2)
-        
-        if not self.current_listings:
-            return "No listings available. Search first."
-        
-        if listing_index < 0 or listing_index >= len(self.current_listings):
-            return f"Invalid listing index. Valid range: 0-{len(self.current_listings)-1}"
+        listing, err = self._resolve(listing_index, listing_id)
+        if err:
+            return err
         
-        listing = self.current_listings[listing_index]
         url = listing.get("listing_url")
         
         if not url:
-            return f"No URL available for listing {listing_index}"
+            return _failure(f"No URL available for listing {listing['index']}")
         
-        success = await self.browser.navigate(url)
+        success = await self._navigate(url)
         if success:
-            await asyncio.sleep(0.5)  # Wait for page load
+            page = self.browser.get_page()
+            if page:
+                await _wait_for_dom(page)
             await self.dismiss_popups(grace_period=0.2)  # Check for popups after navigation
-            return f"Opened listing: {listing['title']} (${listing['price']})"
-        return f"Failed to open listing {listing_index}"
+            return _success(f"Opened listing: {listing['title']} (${listing['price']})", data={"index": listing["index"], "id": listing.get("listing_id"), "url": url})
+        return _failure(f"Failed to open listing {listing['index']}")
     
-    async def _handle_open_chat(self, listing_index: int) -> str:
-        """Handle open_chat tool."""
-        # Dismiss any popups before opening chat
-        await self.dismiss_popups(grace_period=0.2)
+    async def _enrich_listings(self, listings: list[dict], concurrency: int = 4) -> list[dict]:
+        """
+        Fetch and parse the detail pages of several listings concurrently.
         
-        if not self.current_listings:
-            return "No listings available. Search first."
+        Each fetch runs in its own tab so navigations don't stomp on each other
+        or on the user's page; at most `concurrency` tabs are open at once.
+        Results go into the details cache and are merged into the listings.
+        
+        Args:
+            listings: Listings already resolved through _resolve
+            concurrency: Maximum parallel page loads
+            
+        Returns:
+            Details dict per listing ({} for listings that couldn't be fetched)
+        """
+        sem = asyncio.Semaphore(concurrency)
+        
+        async def worker(listing: dict) -> dict:
+            url = listing.get("listing_url")
+            if not url:
+                return {}
+            details = self._listing_details_cache.get(url)
+            if details is None:
+                async with sem:
+                    page = await self.browser.new_context_page()
+                    try:
+                        await page.goto(url, wait_until="domcontentloaded")
+                        await _wait_for_selector(page, _LISTING_MAIN_SELECTOR, timeout=5000)
+                        details = await _read_listing_details(page)
+                    except Exception as e:
+                        print(f"CONTROLLER: Warning - Could not load listing {listing['index']}: {e}")
+                        return {}
+                    finally:
+                        await page.close()
+                self._cache_details(url, details)
+            listing.update(details)
+            return details
         
-        if listing_index < 0 or listing_index >= len(self.current_listings):
-            return f"Invalid listing index. Valid range: 0-{len(self.current_listings)-1}"
+        return await asyncio.gather(*(worker(listing) for listing in listings))
+    
+    async def _handle_compare_listings(
+        self, listing_indices: Optional[list[int]] = None, listing_ids: Optional[list[str]] = None
+    ) -> ToolResult:
+        """Handle compare_listings tool: read several listings' details in parallel tabs."""
+        refs = [(None, i) for i in listing_ids or ()] or [(i, None) for i in listing_indices or ()]
+        if not refs:
+            return _failure("Provide listing_indices or listing_ids.")
+        
+        listings = []
+        for listing_index, listing_id in refs:
+            listing, err = self._resolve(listing_index, listing_id)
+            if err:
+                return err
+            if all(listing is not seen for seen in listings):
+                listings.append(listing)
+        
+        print(f"CONTROLLER: Reading {len(listings)} listing page(s) in parallel...")
+        results = await self._enrich_listings(listings)
+        
+        lines, data = [], []
+        for listing, details in zip(listings, results):
+            description = (details.get("description") or "Could not load this listing.")[:300]
+            condition = details.get("condition") or "unknown"
+            lines.append(f"[{listing['index']}] {listing['title']} (${listing['price']}) - condition: {condition}\n    {description}")
+            data.append({"index": listing["index"], "id": listing.get("listing_id"), "condition": condition, "description": description})
+        return _success("\n".join(lines), data=data)
+    
+    async def _handle_open_chat(self, listing_index: Optional[int] = None, listing_id: Optional[str] = None) -> ToolResult:
+        """Handle open_chat tool."""
+        listing, err = self._resolve(listing_index, listing_id)
+        if err:
+            return err
         
-        listing = self.current_listings[listing_index]
         page = self.browser.get_page()
         
         if not page:
-            return "Browser not ready"
+            return _failure("Browser not ready")
         
         # First, navigate to the listing
         url = listing.get("listing_url")
         if url and page.url != url:
-            await self.browser.navigate(url)
-            await asyncio.sleep(1)
+            await self._navigate(url)
+            await _wait_for_dom(page)
             await self.dismiss_popups(grace_period=0.2)  # Check for popups after navigation
-        
-        # Try to find and click chat button
-        chat_selectors = [
-            '[data-testid="chat-button"]',
-            'button:has-text("Chat")',
-            'a:has-text("Chat")',
-            '[class*="chat"]',
-            'button:has-text("Make Offer")',
-        ]
-        
-        for selector in chat_selectors:
-            try:
-                await page.click(selector, timeout=3000)
-                await asyncio.sleep(1)
-                return f"Opened chat for: {listing['title']}"
-            except Exception:
-                continue
-        
-        return f"Could not find chat button for listing {listing_index}. You may need to login first."
+        else:
+            await self.dismiss_popups(grace_period=0)  # Page already loaded: no need to wait for popups to appear
+
+        # Find and click the chat button: in-page priority walk, then scoped locators in priority order
+        try:
+            clicked = await page.evaluate(_CLICK_CHAT_JS, [_LISTING_MAIN_SELECTOR, _CHAT_CLICK_PRIORITY])
+            if not clicked:
+                clicked = await _click_chat_fallback(page, _OPEN_CHAT_SELECTORS)
+        except Exception:
+            clicked = None
+        if not clicked:
+            return _failure(f"Could not find chat button for listing {listing['index']}. You may need to login first.")
+        
+        await _wait_for_selector(page, _CHAT_INPUT_SELECTOR, timeout=8000)
+        return _success(f"Opened chat for: {listing['title']}", data={"index": listing["index"], "id": listing.get("listing_id")})
+    
+    def _ensure_lowballer(self):
+        """Create the lowballer agent on first use."""
+        if self.lowballer is None:
+            self.lowballer = _load_lowballer().LowballerAgent(self.llm)
     
-    async def _handle_delegate_lowball(self, listing_index: int) -> str:
+    def _cache_details(self, url: str, details: dict):
+        """Remember parsed listing details for a URL, dropping the oldest past _DETAILS_CACHE_SIZE."""
+        self._listing_details_cache[url] = details
+        if len(self._listing_details_cache) > _DETAILS_CACHE_SIZE:
+            del self._listing_details_cache[next(iter(self._listing_details_cache))]
+    
+    async def _handle_delegate_lowball(self, listing_index: Optional[int] = None, listing_id: Optional[str] = None) -> ToolResult:
         """Handle delegate_lowball tool with full navigation flow."""
-        # Dismiss any popups before starting
-        await self.dismiss_popups(grace_period=0.2)
-        
-        if not self.current_listings:
-            return "No listings available. Search first."
-        
-        if listing_index < 0 or listing_index >= len(self.current_listings):
-            return f"Invalid listing index. Valid range: 0-{len(self.current_listings)-1}"
+        listing, err = self._resolve(listing_index, listing_id)
+        if err:
+            return err
         
-        listing = self.current_listings[listing_index]
-        page = self.browser.get_page()
+        page = self._active_page
         
         if not page:
-            return "Browser not ready"
+            return _failure("Browser not ready")
         
         # Step 1: Navigate to listing page to get details
         url = listing.get("listing_url")
         print(f"CONTROLLER: Navigating to listing: {listing['title']} (URL: {url})")
         if url:
-            success = await self.browser.navigate(url)
-            if not success:
-                return f"Failed to navigate to listing URL: {url}"
-            
-            # Wait for the page to actually be a listing page (containing /p/)
-            try:
-                await page.wait_for_url(lambda u: "/p/" in u or "/listing/" in u, timeout=5000)
-            except:
-                print(f"CONTROLLER: Warning - Navigation timed out or URL doesn't look like a listing: {page.url}")
-            
-            await asyncio.sleep(1)
-            await self.dismiss_popups(grace_period=0.2)  # Check for popups after navigation
+            if page.url != url:
+                success = await self._navigate(url, page)
+                if not success:
+                    return _failure(f"Failed to navigate to listing URL: {url}")
+                
+                # Wait for the page to actually be a listing page (containing /p/) with its DOM parsed
+                try:
+                    await page.wait_for_url(_LISTING_URL_RE, wait_until="domcontentloaded", timeout=5000)
+                except Exception:
+                    print(f"CONTROLLER: Warning - Navigation timed out or URL doesn't look like a listing: {page.url}")
+                
+                await self.dismiss_popups(grace_period=0.2)  # Check for popups after navigation
+            else:
+                print("CONTROLLER: Already on the listing page, skipping navigation")
+                await self.dismiss_popups(grace_period=0)
             
-            # Step 2: Extract description and enriched details
-            print("CONTROLLER: Reading listing description...")
-            html = await page.content()
-            details = extract_listing_details(html)
+            # Step 2: Extract description and enriched details (parsed once per URL)
+            details = self._listing_details_cache.get(url)
+            if details is None:
+                print("CONTROLLER: Reading listing description...")
+                details = await _read_listing_details(page)
+                self._cache_details(url, details)
+            else:
+                print("CONTROLLER: Using cached listing description")
             listing.update(details)
             print(f"CONTROLLER: ✓ Description extracted ({len(listing.get('description', ''))} chars)")
+        else:
+            await self.dismiss_popups(grace_period=0)
         
         # Step 3: Open the chat
         print(f"CONTROLLER: Opening chat (Current URL: {page.url})...")
         chat_opened = False
         
-        # Wait a bit more for the page to fully render
-        await asyncio.sleep(2)
+        # Wait for the chat button to render
+        await _wait_for_selector(page, _VIEW_CHAT_SELECTOR, timeout=3000)
         
-        # Strategy 1: Use Playwright's get_by_text for "View Chat" (the variant we see)
+        # Strategy 1: Find and click in a single in-page call
         try:
-            view_chat_btn = page.get_by_text("View Chat", exact=True)
-            if await view_chat_btn.count() > 0 and await view_chat_btn.first.is_visible():
-                await view_chat_btn.first.click()
+            clicked = await page.evaluate(_CLICK_CHAT_JS, [_LISTING_MAIN_SELECTOR, _CHAT_CLICK_PRIORITY])
+            if clicked:
                 chat_opened = True
-                print("CONTROLLER: ✓ Clicked 'View Chat' button via get_by_text")
+                print(f"CONTROLLER: ✓ Clicked chat button via JS ({clicked})")
         except Exception as e:
-            print(f"CONTROLLER: View Chat via get_by_text failed: {e}")
-        
-        # Strategy 2: Use locator with text
-        if not chat_opened:
-            try:
-                btn = page.locator('button:has-text("View Chat")').first
-                if await btn.is_visible():
-                    await btn.click()
-                    chat_opened = True
-                    print("CONTROLLER: ✓ Clicked 'View Chat' button via locator")
-            except Exception:
-                pass
+            print(f"CONTROLLER: JS chat click failed: {e}")
         
-        # Strategy 3: Look for "Chat" button
+        # Strategy 2: Visible matches inside the listing container, in priority order
+        # (CSS variants, then the accessible role); auto-waits for render
         if not chat_opened:
             try:
-                btn = page.get_by_role("button", name=re.compile(r"Chat", re.I))
-                if await btn.count() > 0 and await btn.first.is_visible():
-                    await btn.first.click()
+                clicked = await _click_chat_fallback(page, _CHAT_BUTTON_SELECTORS)
+                if clicked:
                     chat_opened = True
-                    print("CONTROLLER: ✓ Clicked 'Chat' button via role")
-            except Exception:
-                pass
-
-        # Strategy 4: CSS selectors fallback
-        if not chat_opened:
-            chat_selectors = [
-                'button:has-text("View Chat")',
-                'button:has-text("Chat")',
-                'text="View Chat"',
-                'text="Chat"',
-                '[data-testid="chat-button"]',
-                'button:has-text("Chat with Seller")',
-                'a:has-text("View Chat")',
-                'a:has-text("Chat")',
-            ]
-            
-            for selector in chat_selectors:
-                try:
-                    btn = await page.wait_for_selector(selector, timeout=2000)
-                    if btn and await btn.is_visible():
-                        await btn.click()
-                        chat_opened = True
-                        print(f"CONTROLLER: ✓ Clicked chat button via selector ({selector})")
-                        break
-                except Exception:
-                    continue
+                    print(f"CONTROLLER: ✓ Clicked chat button via locator ({clicked})")
+                else:
+                    print("CONTROLLER: No visible chat button in the listing")
+            except Exception as e:
+                print(f"CONTROLLER: Chat button locator failed: {e}")
         
         if not chat_opened:
              # Take screenshot to see what went wrong
-             await self.browser.screenshot("screenshots/chat_open_failed.png")
-             return f"Could not find chat button on listing page. Please check the screenshot."
+             await self.browser.screenshot("screenshots/chat_open_failed.jpg", fmt="jpeg", page=page)
+             return _failure("Could not find chat button on listing page. Please check the screenshot.")
 
-        # Wait for chat page to load and check for popups
-        await asyncio.sleep(2)
+        # Wait for the chat input to render while the lowballer module loads (first use only)
+        input_ready, _ = await asyncio.gather(
+            _wait_for_selector(page, _CHAT_INPUT_SELECTOR, timeout=8000),
+            asyncio.to_thread(_load_lowballer) if _lowballer is None else asyncio.sleep(0),
+        )
+        if not input_ready:
+            print("CONTROLLER: Warning - Chat input not visible yet, continuing anyway")
         await self.dismiss_popups(grace_period=0.2)  # Check for popups after opening chat 
 
-        # Lazy-load lowballer
-        if self.lowballer is None:
-            from lowballer import LowballerAgent
-            self.lowballer = LowballerAgent(self.llm)
+        self._ensure_lowballer()
         
         # Step 4: Delegate to lowballer
         print("CONTROLLER: Handing over to Lowballer Agent...")
@@ -874,15 +2122,16 @@ Be helpful, proactive, and explain what you're doing."""
         )
         
         # Step 5: Post-negotiation idle (User request: go home and refresh)
-        if "Sent offer" in result:
+        # (A worker-tab run never left the main page, so there is nothing to return from)
+        if "Sent offer" in result and _TAB.get() is None:
             print("CONTROLLER: Lowball message sent! Going home to stay idle as requested...")
             # Run a limited idle refresh (e.g., 5-10 refreshes)
             # This is non-blocking in the sense that it completes before returning the result
             await self.browser.idle_refresh(interval=7, max_refreshes=5)
         
-        return result
+        return _success(result, data={"offer_sent": "Sent offer" in result})
 
-    async def _handle_check_chat(self) -> str:
+    async def _handle_check_chat(self) -> ToolResult:
         """
         Reply mode: Go to inbox, open unread chats, sync history, reply, then go home.
         
@@ -890,26 +2139,31 @@ Be helpful, proactive, and explain what you're doing."""
         """
         print("CONTROLLER: 📬 Entering reply mode...")
         
-        # Ensure lowballer is initialized
-        if self.lowballer is None:
-            from lowballer import LowballerAgent
-            self.lowballer = LowballerAgent(self.llm)
-        
+        self._ensure_lowballer()
+
+        # Idle fast path: the header badge on the current page already says whether anything is unread
+        page = self.browser.get_page()
+        if page and "/inbox" not in page.url.lower():
+            unread = await self.browser.get_unread_count()
+            if unread == 0:
+                print("CONTROLLER: No unread badge. Skipping inbox.")
+                return _success("✅ Inbox checked. No new messages. Back to idle.", data={"unread": 0})
+
         # Step 1: Go directly to inbox (no homepage refresh loop)
         print("CONTROLLER: Going to inbox...")
-        success = await self.browser.navigate("https://www.carousell.sg/inbox/")
+        success = await self._navigate("https://www.carousell.sg/inbox/")
         if not success:
-            return "Failed to navigate to inbox."
+            return _failure("Failed to navigate to inbox.")
         
-        await asyncio.sleep(2)
+        await _wait_for_dom(self.browser.get_page())
         await self.browser.handle_carousell_popups()
         
         # Step 2: Find unread chats
         unread_chats = await self.browser.parse_inbox_messages()
         if not unread_chats:
             print("CONTROLLER: No unread messages. Returning to homepage...")
-            await self.browser.navigate("https://www.carousell.sg")
-            return "✅ Inbox checked. No new messages. Back to idle."
+            await self._navigate("https://www.carousell.sg")
+            return _success("✅ Inbox checked. No new messages. Back to idle.", data={"unread": 0})
         
         print(f"CONTROLLER: Found {len(unread_chats)} unread chats to process!")
         replied_count = 0
@@ -927,7 +2181,8 @@ Be helpful, proactive, and explain what you're doing."""
                 print(f"CONTROLLER: ⚠️ Failed to click chat {chat['index']}, skipping...")
                 continue
             
-            await asyncio.sleep(1.5)  # Wait for chat to load
+            # Wait for the chat to load
+            await _wait_for_selector(self.browser.get_page(), _CHAT_INPUT_SELECTOR, timeout=5000)
             
             # Step 4: Scan chat and sync with local history
             # We need listing data - try to get it from existing history or create dummy
@@ -953,75 +2208,75 @@ Be helpful, proactive, and explain what you're doing."""
         
         # Step 6: Done with all chats, go back to homepage (idle)
         print("\nCONTROLLER: All chats processed. Returning to homepage...")
-        await self.browser.navigate("https://www.carousell.sg")
+        await self._navigate("https://www.carousell.sg")
         
-        return f"✅ Reply mode complete. Processed {len(unread_chats)} chats, replied to {replied_count}. Now idle."
+        return _success(
+            f"✅ Reply mode complete. Processed {len(unread_chats)} chats, replied to {replied_count}. Now idle.",
+            data={"processed": len(unread_chats), "replied": replied_count},
+        )
     
-    async def _handle_screenshot(self, filename: Optional[str] = None) -> str:
+    async def _handle_screenshot(self, filename: Optional[str] = None) -> ToolResult:
         """Handle take_screenshot tool."""
         if filename is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"screenshots/screenshot_{timestamp}.png"
         
         path = await self.browser.screenshot(filename)
-        return f"Screenshot saved: {path}"
+        if not path:
+            return _failure("Browser not ready")
+        # The file is written in the background; the capture itself has succeeded
+        return _success(f"Screenshot captured, saving to: {path}", data={"path": path})
     
-    async def _handle_voice_message(self, duration: int = 10) -> str:
+    async def _handle_voice_message(self, duration: int = 10) -> ToolResult:
         """
         Handle send_voice_message tool.
         Records audio from microphone, transcribes using Gemini, and sends to chat.
         """
         page = self.browser.get_page()
         if not page:
-            return "Browser not ready"
+            return _failure("Browser not ready")
         
         # Check if we're on a chat page
         current_url = page.url
         if "/chat/" not in current_url and "/inbox" not in current_url:
-            return "Not currently in a chat. Use 'chat <index>' to open a chat first."
+            return _failure("Not currently in a chat. Use 'chat <index>' to open a chat first.")
         
-        # Import speech transcriber (lazy load)
+        # Import speech transcriber (lazy load, once)
         try:
-            from speech_transcriber import AudioRecorder, SpeechTranscriber, AUDIO_AVAILABLE, GENAI_AVAILABLE
+            speech = _load_speech_transcriber()
         except ImportError:
-            return "Speech transcriber not available. Install: pip install sounddevice scipy google-generativeai"
+            return _failure("Speech transcriber not available. Install: pip install sounddevice scipy google-generativeai")
         
-        if not AUDIO_AVAILABLE:
-            return "Audio recording not available. Install: pip install sounddevice scipy"
+        if not speech.AUDIO_AVAILABLE:
+            return _failure("Audio recording not available. Install: pip install sounddevice scipy")
         
-        if not GENAI_AVAILABLE:
-            return "Gemini API not available. Install: pip install google-generativeai"
+        if not speech.GENAI_AVAILABLE:
+            return _failure("Gemini API not available. Install: pip install google-generativeai")
         
-        # Initialize recorder and transcriber
-        recorder = AudioRecorder()
-        transcriber = SpeechTranscriber()
+        # Recorder and transcriber are reused (the transcriber configures the Gemini client)
+        if self._voice is None:
+            self._voice = (speech.AudioRecorder(), speech.SpeechTranscriber())
+        recorder, transcriber = self._voice
         
         # Record audio
         print(f"\n🎤 VOICE MESSAGE: Recording for {duration} seconds...")
-        audio_path = await recorder.record_async(duration)
+        audio_data = await recorder.record_bytes_async(duration)  # In-memory WAV, no temp file
         
-        if not audio_path:
-            return "Failed to record audio. Check microphone permissions."
+        if not audio_data:
+            return _failure("Failed to record audio. Check microphone permissions.")
         
         # Transcribe
         print("🔄 VOICE MESSAGE: Transcribing...")
-        transcribed_text = await transcriber.transcribe_async(audio_path)
+        transcribed_text = await transcriber.transcribe_bytes_async(audio_data)
         
         if not transcribed_text:
-            return "Failed to transcribe audio. Check Gemini API key."
+            return _failure("Failed to transcribe audio. Check Gemini API key.")
         
         print(f"📝 VOICE MESSAGE: Transcribed → \"{transcribed_text}\"")
         
         # Send to chat (similar to lowballer._send_message)
         try:
-            # Wait for chat input to be ready
-            await asyncio.sleep(1)
-            
-            # Try to find the chat textarea
-            text_box = page.locator('textarea[placeholder="Type here..."]')
-            
-            # Wait for it to be visible
-            await text_box.wait_for(state="visible", timeout=5000)
+            text_box = await self._chat_textbox(page)
             
             # Fill with the transcribed message
             await text_box.fill(transcribed_text)
@@ -1034,41 +2289,45 @@ Be helpful, proactive, and explain what you're doing."""
             await text_box.press("Enter")
             print(f"VOICE MESSAGE: ✓ Message sent")
             
-            # Cleanup audio file
-            try:
-                import os
-                os.remove(audio_path)
-            except:
-                pass
-            
-            return f"Voice message sent: \"{transcribed_text}\""
+            return _success(f"Voice message sent: \"{transcribed_text}\"", data={"text": transcribed_text})
             
         except Exception as e:
             print(f"VOICE MESSAGE: ✗ Failed to send: {e}")
+            self._chat_textbox_cache = None
+            return _failure(
+                f"Transcribed: \"{transcribed_text}\" but failed to send to chat. Chat input not found.",
+                data={"text": transcribed_text},
+            )
+    
+    async def _chat_textbox(self, page):
+        """
+        Locator for the open chat's message input, resolved once per chat page.
+        
+        Args:
+            page: Playwright page showing a chat
             
-            # Fallback: Try alternative selectors
-            fallback_selectors = [
-                'textarea[placeholder*="Type"]',
-                'textarea[placeholder*="message"]',
-                '[contenteditable="true"]',
-                'textarea',
-            ]
-            
-            for selector in fallback_selectors:
-                try:
-                    el = page.locator(selector).first
-                    if await el.is_visible():
-                        await el.fill(transcribed_text)
-                        await el.press("Enter")
-                        return f"Voice message sent: \"{transcribed_text}\""
-                except:
-                    continue
-            
-            return f"Transcribed: \"{transcribed_text}\" but failed to send to chat. Chat input not found."
+        Returns:
+            Visible chat input locator (raises if none appears)
+        """
+        cached = self._chat_textbox_cache
+        if cached and cached[0] == page.url:
+            if await cached[1].is_visible():
+                return cached[1]
+        
+        # The usual textarea or any fallback input, whichever renders
+        text_box = page.locator(_CHAT_TEXTBOX_SELECTOR).or_(
+            page.locator(", ".join(_CHAT_INPUT_FALLBACK_SELECTORS))
+        ).first
+        await text_box.wait_for(state="visible", timeout=5000)
+        self._chat_textbox_cache = (page.url, text_box)
+        return text_box
 
 
 # Standalone test
 if __name__ == "__main__":
+    from browser_loader import BrowserLoader
+    from llm_factory import LLMFactory
+    
     async def test_controller():
         print("=" * 50)
         print("CONTROLLER AGENT TEST")
@@ -1086,7 +2345,7 @@ if __name__ == "__main__":
         controller = ControllerAgent(llm, browser)
         
         # Start background popup monitoring
-        controller.start_popup_monitoring(interval=2.0)
+        controller.start_popup_monitoring()
         
         # Test prompts
         test_prompts = [
@@ -1102,8 +2361,8 @@ if __name__ == "__main__":
         # Keep browser open for inspection
         await asyncio.sleep(10)
         
-        # Stop popup monitoring before closing
-        controller.stop_popup_monitoring()
+        # Stop popup monitoring and close the worker tab before closing
+        await controller.close()
         await browser.close()
     
     asyncio.run(test_controller())
@@ -8,14 +8,32 @@ Provides:
 """
 
 import re
+import json
+import hashlib
 from typing import Optional
 from bs4 import BeautifulSoup
 from pydantic import BaseModel
 
+try:
+    import lxml  # noqa: F401  C-based parser backend for BeautifulSoup (several times faster)
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+# BeautifulSoup parser: lxml when installed, else the pure-Python stdlib parser
+_HTML_PARSER = "lxml" if LXML_AVAILABLE else "html.parser"
+
+# Patterns used per listing card / detail page, compiled once
+_PRICE_RE = re.compile(r'[\d,]+(?:\.\d{1,2})?')
+_LISTING_ID_RE = re.compile(r'/p/[^/?#]*?(\d+)/?(?:[?#]|$)')
+_DESCRIPTION_HEADER_RE = re.compile(r'Description', re.I)
+_DETAILS_HEADER_RE = re.compile(r'Details', re.I)
+
 
 class CarousellListing(BaseModel):
     """Structured representation of a Carousell listing."""
     index: int
+    listing_id: str
     title: str
     price: float
     price_raw: str
@@ -43,7 +61,7 @@ def parse_price(price_str: str) -> float:
         
     # Extract only the currency-related part (digits, commas, dots)
     # We look for the first occurrence of $ followed by numbers, or just numbers
-    match = re.search(r'[\d,]+(?:\.\d{1,2})?', price_str)
+    match = _PRICE_RE.search(price_str)
     if not match:
         return 0.0
         
@@ -71,7 +89,7 @@ def parse_listings(dom_data: dict) -> list[dict]:
     
     print("DOM_PARSER: Parsing Carousell listings...")
     
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = BeautifulSoup(html, _HTML_PARSER)
     listings = []
     
     # Use the exact Carousell structure: data-testid="listing-card-XXXX"
@@ -79,9 +97,9 @@ def parse_listings(dom_data: dict) -> list[dict]:
     
     print(f"DOM_PARSER: Found {len(listing_cards)} listing cards")
     
-    # Extract info and index sequentially
-    for idx, card in enumerate(listing_cards[:20]):  # Limit to first 20
-        listing = extract_listing_info(card, idx)
+    # Extract info and index sequentially (numbered by valid listing, so indexes have no gaps)
+    for card in listing_cards[:20]:  # Limit to first 20
+        listing = extract_listing_info(card, len(listings))
         if listing and listing.get("price", 0) > 0:
             listings.append(listing)
     
@@ -89,6 +107,22 @@ def parse_listings(dom_data: dict) -> list[dict]:
     return listings
 
 
+def listing_id_from_url(url: str) -> str:
+    """
+    Stable id for a listing, unaffected by re-searches and re-ordering.
+    
+    Args:
+        url: Listing URL (e.g. https://www.carousell.sg/p/iphone-14-1234567890/)
+        
+    Returns:
+        Carousell's numeric listing id, or a short hash of the URL if absent
+    """
+    match = _LISTING_ID_RE.search(url)
+    if match:
+        return match.group(1)
+    return hashlib.md5(url.encode()).hexdigest()[:10]
+
+
 def extract_listing_info(container, index: int) -> Optional[dict]:
     """
     Extract listing information from a Carousell listing card.
@@ -162,6 +196,7 @@ def extract_listing_info(container, index: int) -> Optional[dict]:
             
         return {
             "index": index,
+            "listing_id": listing_id_from_url(listing_url),
             "title": title[:100],
             "price": price,
             "price_raw": price_text,
@@ -179,16 +214,84 @@ def extract_listing_info(container, index: int) -> Optional[dict]:
         return None
 
 
+# Schema.org JSON-LD script blocks in raw HTML
+_JSON_LD_RE = re.compile(r'<script[^>]*type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.S | re.I)
+
+# Schema.org itemCondition values -> Carousell condition labels
+_SCHEMA_CONDITIONS = {
+    "NewCondition": "Brand new",
+    "UsedCondition": "Used",
+    "RefurbishedCondition": "Refurbished",
+    "DamagedCondition": "Damaged",
+}
+
+
+def parse_json_ld_product(blocks: list[str]) -> Optional[dict]:
+    """
+    Read listing details from Schema.org Product JSON-LD blocks, if any.
+    
+    Args:
+        blocks: Text of the page's application/ld+json scripts
+        
+    Returns:
+        Dict with description and condition, or None if there is no Product block
+    """
+    for block in blocks:
+        try:
+            data = json.loads(block)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            data = data.get("@graph", [data])
+        items = data if isinstance(data, list) else []
+        for item in items:
+            if not isinstance(item, dict) or item.get("@type") != "Product" or not item.get("description"):
+                continue
+            offers = item.get("offers") or {}
+            if isinstance(offers, list):
+                offers = offers[0] if offers else {}
+            condition = str(item.get("itemCondition") or offers.get("itemCondition") or "")
+            condition = condition.rstrip("/").rsplit("/", 1)[-1]
+            return {
+                "description": item["description"].strip(),
+                "condition": _SCHEMA_CONDITIONS.get(condition, condition),
+            }
+    return None
+
+
+def merge_json_ld_product(details: dict, product: Optional[dict]) -> dict:
+    """
+    Merge Product JSON-LD fields into details parsed from the page.
+    
+    The JSON-LD description (the seller's full text) replaces the heuristic one;
+    its condition only fills in when the page's Details section had none.
+    
+    Args:
+        details: Details dict from extract_listing_details (updated in place)
+        product: Result of parse_json_ld_product, or None
+        
+    Returns:
+        The updated details dict
+    """
+    if product:
+        details["description"] = product["description"]
+        if not details.get("condition") and product["condition"]:
+            details["condition"] = product["condition"]
+    return details
+
+
 def extract_listing_details(html: str) -> dict:
     """
     Extract detailed information from a single listing page (description, details, etc.).
+    
+    Product JSON-LD in the HTML, if any, is merged into the result.
     """
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = BeautifulSoup(html, _HTML_PARSER)
     details = {}
     
     # 1. Extract Description
     # We use find() with text instead of invalid CSS :has-text
-    desc_header = soup.find(['h2', 'h3', 'p'], string=re.compile(r'Description', re.I))
+    desc_header = soup.find(['h2', 'h3', 'p'], string=_DESCRIPTION_HEADER_RE)
     desc_elem = soup.select_one('[data-testid*="description"], [class*="description"]')
     
     if not desc_elem and desc_header:
@@ -202,7 +305,7 @@ def extract_listing_details(html: str) -> dict:
 
     # 2. Extract structured "Details" section (Condition, Battery Health, etc.)
     # Look for the section after "Details" header
-    details_header = soup.find(['h2', 'h3', 'p'], string=re.compile(r'Details', re.I))
+    details_header = soup.find(['h2', 'h3', 'p'], string=_DETAILS_HEADER_RE)
     if details_header:
         # Find the container - Carousell usually uses a grid or list after the header
         container = details_header.find_parent().find_parent() or details_header.parent
@@ -232,8 +335,9 @@ def extract_listing_details(html: str) -> dict:
             details["structured_details"] = extracted_pairs
             # Also flatten some into the main dict for backward compatibility
             details["condition"] = extracted_pairs.get("Condition", "")
-            
-    return details
+    
+    json_ld = [m.group(1) for m in _JSON_LD_RE.finditer(html)]
+    return merge_json_ld_product(details, parse_json_ld_product(json_ld))
 
 
 def filter_listings_by_price(listings: list[dict], max_price: float) -> list[dict]:
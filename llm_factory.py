@@ -4,11 +4,14 @@ Purpose: Provides LiteLLM-based abstraction for switching between Ollama and Gem
 
 Provides:
 - LLMFactory.from_env() → creates LLM client based on .env settings
+- LLMFactory.cached(client) → wraps a client with an exact-match response cache
 - Unified completion interface for all agent modules
 """
 
 import os
 import json
+import hashlib
+from collections import OrderedDict
 from typing import Optional, Callable, Any
 from config import config
 
@@ -20,6 +23,12 @@ except ImportError:
     LITELLM_AVAILABLE = False
     print("LLM_FACTORY: Warning - LiteLLM not installed, using mock mode")
 
+try:
+    import orjson  # Faster serialization of cache keys
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 
 class LLMClient:
     """
@@ -114,27 +123,12 @@ class LLMClient:
                     result["tool_calls"].append({
                         "id": tc.id,
                         "name": tc.function.name,
-                        "arguments": json.loads(tc.function.arguments),
+                        # Raw JSON string; the consumer parses it once (malformed JSON
+                        # then fails only that call, not the whole completion)
+                        "arguments": tc.function.arguments,
                     })
             
-            # Fallback: some models return tool calls as JSON in the content field
-            if not result["tool_calls"] and result["content"]:
-                content = result["content"].strip()
-                # Try to parse JSON from content
-                if content.startswith("{") and "function" in content:
-                    try:
-                        parsed = json.loads(content)
-                        # Format: {"function": {"name": "...", "arguments": {...}}}
-                        if "function" in parsed:
-                            func = parsed["function"]
-                            result["tool_calls"].append({
-                                "id": "fallback_1",
-                                "name": func.get("name", ""),
-                                "arguments": func.get("arguments", {}),
-                            })
-                            result["content"] = ""  # Clear content since we parsed it
-                    except json.JSONDecodeError:
-                        pass
+            self._parse_content_tool_call(result)
             
             print(f"LLM_FACTORY: ✓ Generated {len(result['content'])} chars")
             if result["tool_calls"]:
@@ -146,6 +140,138 @@ class LLMClient:
             print(f"LLM_FACTORY: ✗ Completion failed → {e}")
             return {"content": f"Error: {e}", "tool_calls": [], "error": str(e)}
     
+    async def complete_streaming(
+        self,
+        messages: list[dict],
+        tools: Optional[list[dict]] = None,
+        max_tokens: int = 1024,
+        on_tool_call: Optional[Callable[[dict], Any]] = None,
+    ) -> dict:
+        """
+        Stream a completion, reporting each tool call as soon as it is fully decoded.
+        
+        Lets the caller start running a tool while the model is still generating
+        the rest of its response.
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            tools: Optional list of tool definitions for function calling
+            max_tokens: Maximum tokens to generate
+            on_tool_call: Called with each finished tool call, in order
+            
+        Returns:
+            Same shape as complete(); 'tool_calls' holds every call passed to on_tool_call
+        """
+        if not LITELLM_AVAILABLE:
+            result = self._mock_complete(messages, tools)
+            for tc in result["tool_calls"]:
+                if on_tool_call:
+                    on_tool_call(tc)
+            return result
+        
+        result = {"content": "", "tool_calls": []}
+        building: dict[int, dict] = {}  # Stream index → call being decoded
+        
+        def finish(index: int):
+            tc = building.pop(index)
+            result["tool_calls"].append(tc)
+            if on_tool_call:
+                on_tool_call(tc)
+        
+        try:
+            print(f"LLM_FACTORY: Streaming completion ({len(messages)} messages)...")
+            
+            kwargs = {
+                "model": self.model,
+                "messages": messages,
+                "temperature": self.temperature,
+                "max_tokens": max_tokens,
+                "stream": True,
+            }
+            
+            if self.api_base and "ollama" in self.model:
+                kwargs["api_base"] = self.api_base
+            
+            if tools:
+                kwargs["tools"] = tools
+                kwargs["tool_choice"] = "auto"
+            
+            content_parts = []
+            async for chunk in await acompletion(**kwargs):
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if getattr(delta, "content", None):
+                    content_parts.append(delta.content)
+                
+                for tc_delta in getattr(delta, "tool_calls", None) or ():
+                    index = getattr(tc_delta, "index", None)
+                    if index is None:
+                        index = len(result["tool_calls"]) + len(building)
+                    if index not in building:
+                        # A new call starts, so every earlier one is complete
+                        for done in sorted(i for i in building if i < index):
+                            finish(done)
+                        building[index] = {"id": None, "name": "", "arguments": ""}
+                    tc = building[index]
+                    if tc_delta.id:
+                        tc["id"] = tc_delta.id
+                    function = tc_delta.function
+                    if function is not None:
+                        if function.name:
+                            tc["name"] = function.name
+                        if function.arguments:
+                            tc["arguments"] += function.arguments
+            
+            for index in sorted(building):
+                finish(index)
+            result["content"] = "".join(content_parts)
+            
+            if not result["tool_calls"] and self._parse_content_tool_call(result) and on_tool_call:
+                on_tool_call(result["tool_calls"][0])
+            
+            print(f"LLM_FACTORY: ✓ Streamed {len(result['content'])} chars")
+            if result["tool_calls"]:
+                print(f"LLM_FACTORY: ✓ Tool calls: {[tc['name'] for tc in result['tool_calls']]}")
+            
+            return result
+            
+        except Exception as e:
+            print(f"LLM_FACTORY: ✗ Streaming completion failed → {e}")
+            # Calls already handed to on_tool_call are kept so the caller can account for them
+            return {"content": f"Error: {e}", "tool_calls": result["tool_calls"], "error": str(e)}
+    
+    @staticmethod
+    def _parse_content_tool_call(result: dict) -> bool:
+        """
+        Fallback for models that return a tool call as JSON in the content field.
+        
+        Moves the call into result['tool_calls'] and clears the content.
+        
+        Returns:
+            True if a tool call was found
+        """
+        if result["tool_calls"] or not result["content"]:
+            return False
+        content = result["content"].strip()
+        if not (content.startswith("{") and "function" in content):
+            return False
+        try:
+            parsed = json.loads(content)
+        except json.JSONDecodeError:
+            return False
+        # Format: {"function": {"name": "...", "arguments": {...}}}
+        if not isinstance(parsed, dict) or "function" not in parsed:
+            return False
+        func = parsed["function"]
+        result["tool_calls"].append({
+            "id": "fallback_1",
+            "name": func.get("name", ""),
+            "arguments": func.get("arguments", {}),
+        })
+        result["content"] = ""  # Clear content since we parsed it
+        return True
+    
     def complete_sync(
         self,
         messages: list[dict],
@@ -164,6 +290,10 @@ class LLMClient:
         
         last_message = messages[-1]["content"] if messages else ""
         
+        # Tool results came back: answer in text so the tool loop ends
+        if messages and messages[-1].get("role") == "tool":
+            return {"content": "Done. Let me know what you'd like to do next.", "tool_calls": []}
+        
         # Simple mock responses based on keywords
         if "search" in last_message.lower():
             return {
@@ -247,6 +377,101 @@ Write a natural negotiation message."""
             return f"Hi! Would you take ${offer_price} for quick pickup today?"
 
 
+class CachedLLMClient:
+    """
+    LLMClient wrapper that answers repeated identical requests from memory.
+    
+    The key covers the whole request, so this only pays off for stateless
+    sub-calls that can repeat exactly (e.g. classifying the same seller reply);
+    an agent conversation grows every turn and never hits.
+    
+    Only text answers are cached; responses that call tools (which act on the
+    browser) and failed completions always go to the model.
+    """
+    
+    def __init__(self, client: LLMClient, maxsize: int = 256):
+        """
+        Args:
+            client: Underlying LLM client
+            maxsize: Max cached responses (least recently used evicted first)
+        """
+        self._client = client
+        self._maxsize = maxsize
+        self._cache: OrderedDict[str, dict] = OrderedDict()
+        self._tools_digest: tuple[Optional[list[dict]], str] = (None, "")
+        self.hits = 0
+    
+    def __getattr__(self, name: str) -> Any:
+        # model, generate_lowball_message, ... come from the wrapped client
+        return getattr(self._client, name)
+    
+    @staticmethod
+    def _digest(data: Any) -> str:
+        """Stable hash of JSON-able data (keys sorted)."""
+        if ORJSON_AVAILABLE:
+            payload = orjson.dumps(data, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        else:
+            payload = json.dumps(data, sort_keys=True, default=str).encode()
+        return hashlib.blake2b(payload, digest_size=20).hexdigest()
+    
+    def _key(self, messages: list[dict], tools: Optional[list[dict]], max_tokens: int) -> str:
+        """Hash of the whole conversation (system prompt and history) plus the full tool schemas."""
+        # The same tools list is passed on every call: hash its schemas once
+        cached_tools, tools_hash = self._tools_digest
+        if tools is not cached_tools:
+            tools_hash = self._digest(tools or [])
+            self._tools_digest = (tools, tools_hash)
+        return self._digest({"msgs": messages, "tools": tools_hash, "max_tokens": max_tokens})
+    
+    async def complete(
+        self,
+        messages: list[dict],
+        tools: Optional[list[dict]] = None,
+        max_tokens: int = 1024,
+    ) -> dict:
+        """Same as LLMClient.complete, served from cache when possible."""
+        key = self._key(messages, tools, max_tokens)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            print("LLM_FACTORY: ✓ Cache hit")
+            return dict(cached)
+        
+        result = await self._client.complete(messages, tools, max_tokens)
+        self._store(key, result)
+        return result
+    
+    async def complete_streaming(
+        self,
+        messages: list[dict],
+        tools: Optional[list[dict]] = None,
+        max_tokens: int = 1024,
+        on_tool_call: Optional[Callable[[dict], Any]] = None,
+    ) -> dict:
+        """Same as LLMClient.complete_streaming, served from cache when possible."""
+        key = self._key(messages, tools, max_tokens)
+        cached = self._cache.get(key)
+        if cached is not None:
+            # Cached responses never carry tool calls, so there is nothing to report
+            self._cache.move_to_end(key)
+            self.hits += 1
+            print("LLM_FACTORY: ✓ Cache hit")
+            return dict(cached)
+        
+        result = await self._client.complete_streaming(messages, tools, max_tokens, on_tool_call)
+        self._store(key, result)
+        return result
+    
+    def _store(self, key: str, result: dict):
+        """Cache a text answer (tool-calling and failed responses are skipped)."""
+        if result.get("tool_calls") or result.get("error"):
+            return
+        self._cache[key] = {k: v for k, v in result.items() if k != "raw_response"}
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+
+
 class LLMFactory:
     """Factory for creating LLM clients based on configuration."""
     
@@ -277,6 +502,11 @@ class LLMFactory:
                 api_base="http://localhost:11434",
             )
     
+    @staticmethod
+    def cached(client: LLMClient, maxsize: int = 256) -> CachedLLMClient:
+        """Wrap a client so repeated identical requests skip the model."""
+        return CachedLLMClient(client, maxsize=maxsize)
+    
     @staticmethod
     def create_ollama(model: str = "phi3:mini", url: str = "http://localhost:11434") -> LLMClient:
         """Create an Ollama client with explicit settings."""
@@ -124,6 +124,8 @@ class LowballerAgent:
             persona: Negotiation style to use (default: CHRIS_VOSS)
         """
         self.llm = llm
+        # Seller-reply classification is a stateless sub-call: a re-synced chat repeats it exactly
+        self._classifier_llm = LLMFactory.cached(llm, maxsize=128)
         self.persona = persona
         self.chat_history_file = Path("chat_history.json")
         self.chat_history: dict[str, list] = self._load_chat_history()
@@ -316,7 +318,7 @@ Classify this response:"""
         ]
         
         try:
-            response = await self.llm.complete(messages, max_tokens=10)
+            response = await self._classifier_llm.complete(messages, max_tokens=10)
             result = response.get("content", "").strip().upper()
             
             if "ACCEPT" in result:
@@ -458,9 +460,6 @@ Write ONLY the message itself, nothing else. Keep it to 1-2 sentences max."""
             
         print(f"LOWBALLER: Waiting for chat input on {page.url}...")
         
-        # Wait for page to settle
-        await asyncio.sleep(2)
-        
         # Use the exact Carousell chat textarea selector
         try:
             text_box = page.locator('textarea[placeholder="Type here..."]')
@@ -479,33 +478,33 @@ Write ONLY the message itself, nothing else. Keep it to 1-2 sentences max."""
             await text_box.press("Enter")
             print(f"LOWBALLER: ✓ Message sent (Enter key)")
             
-            # Wait a moment for the message to be sent
-            await asyncio.sleep(1)
+            # Wait for the input to clear, which happens once the message is sent
+            try:
+                await page.wait_for_function(
+                    "el => el.value === ''", arg=await text_box.element_handle(), timeout=3000
+                )
+            except Exception:
+                pass
             return True
             
         except Exception as e:
             print(f"LOWBALLER: ✗ Failed to send message: {e}")
             
-            # Fallback: Try alternative selectors
-            fallback_selectors = [
-                'textarea[placeholder*="Type"]',
-                'textarea[placeholder*="message"]',
-                '[contenteditable="true"]',
-                'textarea',
-            ]
-            
-            for selector in fallback_selectors:
-                try:
-                    el = page.locator(selector).first
-                    if await el.is_visible():
-                        await el.fill(message)
-                        await el.press("Enter")
-                        print(f"LOWBALLER: ✓ Message sent via fallback ({selector})")
-                        return True
-                except:
-                    continue
+            # Fallback: first visible alternative input, resolved in one query
+            fallback = page.locator(
+                'textarea[placeholder*="Type"]:visible, textarea[placeholder*="message"]:visible, '
+                '[contenteditable="true"]:visible, textarea:visible'
+            ).first
+            try:
+                if await fallback.count():
+                    await fallback.fill(message)
+                    await fallback.press("Enter")
+                    print("LOWBALLER: ✓ Message sent via fallback input")
+                    return True
+            except Exception:
+                pass
             
-            await page.screenshot(path="screenshots/chat_input_not_found.png")
+            await page.screenshot(path="screenshots/chat_input_not_found.jpg", type="jpeg", quality=60)
             return False
     
     async def sync_conversation(self, listing_data: dict, page: Any) -> list[dict]:
@@ -19,6 +19,12 @@ from llm_factory import LLMFactory
 from config import config
 from bridge_server import BridgeServer
 
+try:
+    import uvloop  # Faster event loop (not available on Windows)
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
 
 # ASCII Art Banner
 BANNER = r"""
@@ -72,6 +78,7 @@ async def main():
     
     # Initialize browser
     browser = BrowserLoader(headless=config.agent.headless_browser)
+    controller = None
     
     try:
         print("\n🚀 Launching browser...")
@@ -208,10 +215,11 @@ async def main():
                 print(f"\n🤖 Processing...")
                 bridge.add_log("AGENT", "Processing command...")
                 
-                result = await controller.run(prompt)
-                
-                print(f"\n{result}")
-                bridge.add_log("AGENT", result)
+                # Print each tool result as soon as it is ready
+                print()
+                async for chunk in controller.run_stream(prompt):
+                    print(chunk)
+                    bridge.add_log("AGENT", chunk)
                 
             except KeyboardInterrupt:
                 print("\n\n⚠️ Interrupted. Type 'quit' to exit or continue...")
@@ -223,12 +231,16 @@ async def main():
     finally:
         # Cleanup
         print("\n🧹 Cleaning up...")
+        if controller:
+            await controller.close()
         await browser.close()
         print("✅ Browser closed.")
 
 
 def run():
     """Synchronous entry point."""
+    if UVLOOP_AVAILABLE:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -3,11 +3,12 @@ MODULE: Speech Transcriber
 Purpose: Record audio from microphone and transcribe using Gemini API
 
 Provides:
-- AudioRecorder: Record audio from microphone to WAV file
+- AudioRecorder: Record audio from microphone to WAV file or in-memory WAV bytes
 - SpeechTranscriber: Transcribe audio using Gemini API
 - record_and_transcribe(): Convenience function for full flow
 """
 
+import io
 import os
 import tempfile
 import asyncio
@@ -56,7 +57,7 @@ class AudioRecorder:
     
     def record(self, duration: int = 10, output_path: Optional[str] = None) -> Optional[str]:
         """
-        Record audio from microphone.
+        Record audio from microphone and save it as a WAV file (see record_bytes).
         
         Args:
             duration: Recording duration in seconds
@@ -65,50 +66,72 @@ class AudioRecorder:
         Returns:
             Path to recorded WAV file, or None if recording failed
         """
-        if not AUDIO_AVAILABLE:
-            print("SPEECH: ✗ Audio recording not available (install sounddevice scipy)")
+        data = self.record_bytes(duration)
+        if data is None:
             return None
         
         if output_path is None:
             import time
             output_path = str(self.recordings_dir / f"voice_{int(time.time())}.wav")
         
+        try:
+            Path(output_path).write_bytes(data)
+        except OSError as e:
+            print(f"SPEECH: ✗ Could not save recording: {e}")
+            return None
+        
+        print(f"SPEECH: ✓ Saved recording to {output_path}")
+        return output_path
+    
+    async def record_async(self, duration: int = 10) -> Optional[str]:
+        """Async wrapper for record() to use in async context."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.record, duration, None)
+    
+    def record_bytes(self, duration: int = 10) -> Optional[bytes]:
+        """
+        Record audio from microphone into in-memory WAV bytes (no file on disk).
+        
+        Args:
+            duration: Recording duration in seconds
+            
+        Returns:
+            WAV file contents, or None if recording failed
+        """
+        if not AUDIO_AVAILABLE:
+            print("SPEECH: ✗ Audio recording not available (install sounddevice scipy)")
+            return None
+        
         print(f"\n🎤 Recording for {duration} seconds... (speak now)")
         print("   Press Ctrl+C to stop early")
         
+        recording = None
         try:
-            # Record audio
             recording = sd.rec(
                 int(duration * self.sample_rate),
                 samplerate=self.sample_rate,
                 channels=self.channels,
                 dtype=np.int16
             )
-            
-            # Wait for recording to complete
             sd.wait()
-            
-            # Save to WAV file
-            wav.write(output_path, self.sample_rate, recording)
-            
-            print(f"SPEECH: ✓ Recorded {duration}s to {output_path}")
-            return output_path
-            
         except KeyboardInterrupt:
             sd.stop()
             print("\nSPEECH: Recording stopped early")
-            if len(recording) > 0:
-                wav.write(output_path, self.sample_rate, recording)
-                return output_path
-            return None
+            if recording is None or len(recording) == 0:
+                return None
         except Exception as e:
             print(f"SPEECH: ✗ Recording failed: {e}")
             return None
+        
+        buffer = io.BytesIO()
+        wav.write(buffer, self.sample_rate, recording)
+        print(f"SPEECH: ✓ Recorded {duration}s ({buffer.tell()} bytes)")
+        return buffer.getvalue()
     
-    async def record_async(self, duration: int = 10) -> Optional[str]:
-        """Async wrapper for record() to use in async context."""
+    async def record_bytes_async(self, duration: int = 10) -> Optional[bytes]:
+        """Async wrapper for record_bytes() to use in async context."""
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.record, duration, None)
+        return await loop.run_in_executor(None, self.record_bytes, duration)
 
 
 class SpeechTranscriber:
@@ -164,17 +187,40 @@ class SpeechTranscriber:
             # Read audio file
             with open(audio_path, "rb") as f:
                 audio_data = f.read()
+        except OSError as e:
+            print(f"SPEECH: ✗ Could not read audio file: {e}")
+            return None
+        
+        # Determine MIME type based on extension
+        ext = Path(audio_path).suffix.lower()
+        mime_types = {
+            ".wav": "audio/wav",
+            ".mp3": "audio/mp3",
+            ".m4a": "audio/m4a",
+            ".ogg": "audio/ogg",
+        }
+        return self.transcribe_bytes(audio_data, mime_types.get(ext, "audio/wav"))
+    
+    def transcribe_bytes(self, audio_data: bytes, mime_type: str = "audio/wav") -> Optional[str]:
+        """
+        Transcribe in-memory audio to text.
+        
+        Args:
+            audio_data: Encoded audio (e.g. WAV file contents)
+            mime_type: MIME type of audio_data
             
-            # Determine MIME type based on extension
-            ext = Path(audio_path).suffix.lower()
-            mime_types = {
-                ".wav": "audio/wav",
-                ".mp3": "audio/mp3",
-                ".m4a": "audio/m4a",
-                ".ogg": "audio/ogg",
-            }
-            mime_type = mime_types.get(ext, "audio/wav")
-            
+        Returns:
+            Transcribed text, or None if transcription failed
+        """
+        if not GENAI_AVAILABLE:
+            print("SPEECH: ✗ Transcription not available (install google-generativeai)")
+            return None
+        
+        if not self.model:
+            print("SPEECH: ✗ Gemini API not configured")
+            return None
+        
+        try:
             # Create audio part for Gemini
             audio_part = {
                 "mime_type": mime_type,
@@ -200,6 +246,11 @@ class SpeechTranscriber:
         """Async wrapper for transcribe() to use in async context."""
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(None, self.transcribe, audio_path)
+    
+    async def transcribe_bytes_async(self, audio_data: bytes, mime_type: str = "audio/wav") -> Optional[str]:
+        """Async wrapper for transcribe_bytes() to use in async context."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.transcribe_bytes, audio_data, mime_type)
 
 
 async def record_and_transcribe(duration: int = 10) -> Optional[str]:
@@ -215,21 +266,13 @@ async def record_and_transcribe(duration: int = 10) -> Optional[str]:
     recorder = AudioRecorder()
     transcriber = SpeechTranscriber()
     
-    # Record audio
-    audio_path = await recorder.record_async(duration)
-    if not audio_path:
+    # Record audio (kept in memory, nothing to clean up)
+    audio_data = await recorder.record_bytes_async(duration)
+    if not audio_data:
         return None
     
     # Transcribe
-    text = await transcriber.transcribe_async(audio_path)
-    
-    # Cleanup temp file
-    try:
-        os.remove(audio_path)
-    except:
-        pass
-    
-    return text
+    return await transcriber.transcribe_bytes_async(audio_data)
 
 
 # Standalone test